@@ -0,0 +1,225 @@
+#! /bin/env python
+#
+#    Sgt.Skinner - A Minecraft skin editor
+#    Copyright (C) 2020 Johan Thelin
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Benchmarks of the Document and ImageEditor hot paths on synthetic jars and packs
+
+import os
+import sys
+import time
+import json
+import random
+import zipfile
+import argparse
+import shutil
+import tempfile
+
+# Must be set before Qt is loaded, so no display is needed
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide2.QtWidgets import QApplication
+from PySide2.QtGui import QImage, QPainter, QColor, QPixmap
+from PySide2.QtCore import Qt, QBuffer, QByteArray, QIODevice, QModelIndex, QPoint, QStandardPaths
+
+def syntheticImage(index, size, seed):
+    # Blocky pixel art with a handful of colours, close to real textures
+    rnd = random.Random(index * 7919 + seed)
+    img = QImage(size, size, QImage.Format_ARGB32)
+    img.fill(QColor(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    p = QPainter(img)
+    block = max(1, size // 8)
+    for i in range(16):
+        p.fillRect(rnd.randrange(size), rnd.randrange(size), block, block, QColor(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), rnd.choice([0, 128, 255])))
+    p.end()
+    return img
+
+def pngBytes(img):
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.WriteOnly)
+    img.save(buf, "PNG")
+    return bytes(data)
+
+def textureName(index):
+    return "assets/minecraft/textures/block/bench_%05d.png" % index
+
+def makeJar(path, files, size):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i in range(files):
+            zf.writestr(textureName(i), pngBytes(syntheticImage(i, size, 0)))
+        zf.writestr("assets/minecraft/lang/en_us.json", "{}")
+
+def makePack(path, files, size):
+    # A quarter is copied unchanged, a quarter is resized, and the rest is repainted
+    os.makedirs(path + "/assets", exist_ok=True)
+    for i in range(files):
+        if i % 4 == 0:
+            img = syntheticImage(i, size, 0)
+        elif i % 4 == 1:
+            img = syntheticImage(i, size * 2, 1)
+        else:
+            img = syntheticImage(i, size, 1)
+        fn = path + "/" + textureName(i)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        img.save(fn, "PNG")
+    syntheticImage(0, 64, 2).save(path + "/pack.png", "PNG")
+
+class Timings:
+    def __init__(self):
+        self.results = {}
+
+    def measure(self, name, items, func):
+        # One sample per call, items is the number of textures the call processes
+        start = time.perf_counter()
+        res = func()
+        elapsed = time.perf_counter() - start
+        self.results.setdefault(name, { "samples": [], "items": 0 })
+        self.results[name]["samples"].append(elapsed)
+        self.results[name]["items"] += items
+        return res
+
+    def summary(self):
+        res = {}
+        for name, r in self.results.items():
+            samples = sorted(r["samples"])
+            total = sum(samples)
+            res[name] = { "runs": len(samples)
+                        , "total_s": total
+                        , "p50_ms": percentile(samples, 50) * 1000.0
+                        , "p90_ms": percentile(samples, 90) * 1000.0
+                        , "p99_ms": percentile(samples, 99) * 1000.0
+                        , "items_per_s": r["items"] / total if total > 0 else 0.0 }
+        return res
+
+def percentile(samples, p):
+    if len(samples) == 0:
+        return 0.0
+    k = (len(samples) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (k - lo)
+
+def run(args, workdir):
+    from skindocument import Document
+    from sgtskinner import ImageEditor, DocumentModel
+
+    jar = workdir + "/minecraft.jar"
+    pack = workdir + "/pack"
+    makeJar(jar, args.files, args.size)
+    makePack(pack, args.files, args.size)
+    names = [textureName(i) for i in range(args.files)]
+    sampled = names[:min(len(names), args.samples)]
+
+    t = Timings()
+    for i in range(args.runs):
+        doc = Document(background = False)
+        t.measure("setMinecraftJar", args.files, lambda: doc.setMinecraftJar(jar))
+        for fn in sampled:
+            t.measure("getOriginalImage.cold", 1, lambda: doc.getOriginalImage(fn))
+        for fn in sampled:
+            t.measure("getOriginalImage.warm", 1, lambda: doc.getOriginalImage(fn))
+
+        t.measure("load", args.files, lambda: doc.load(pack))
+        for fn in sampled:
+            t.measure("getImage.cold", 1, lambda: doc.getImage(fn))
+        t.measure("compareWithOriginals", args.files, doc.compareWithOriginals)
+        t.measure("saveAs", args.files, lambda: doc.saveAs(workdir + "/out-%d" % i))
+
+        # A changed pixel each, so the images are encoded rather than copied through
+        for fn in sampled:
+            img = doc.getImage(fn).convertToFormat(QImage.Format_ARGB32)
+            img.setPixelColor(0, 0, QColor(Qt.blue) if img.pixelColor(0, 0) == QColor(Qt.red) else QColor(Qt.red))
+            doc.setImage(fn, img)
+        t.measure("save.dirty", len(sampled), doc.save)
+
+        # Run the thumbnail pass to completion, one batch at a time as the timer would
+        doc.setMinecraftJar(jar)
+        doc.load(pack)
+        while doc.hasPendingThumbnails():
+            t.measure("thumbnails.batch", Document.THUMBNAIL_BATCH, doc.buildThumbnails)
+        model = DocumentModel(doc)
+        model.on_all_changed()
+        for row in range(min(model.rowCount(QModelIndex()), args.samples)):
+            for column in range(2):
+                index = model.index(row, column)
+                t.measure("DocumentModel.data", 1, lambda: model.data(index, Qt.DecorationRole))
+
+        editor = ImageEditor()
+        editor.resize(args.editor, args.editor)
+        editor.setOriginalImage(doc.getOriginalImage(names[0]))
+        editor.setImage(doc.getImage(names[0]))
+        target = QPixmap(editor.size())
+        for alpha in range(0, 256, 8):
+            t.measure("ImageEditor.setOriginalAlpha+paint", 1, lambda: (editor.setOriginalAlpha(alpha), editor.render(target)))
+        for j in range(32):
+            t.measure("ImageEditor.paint", 1, lambda: editor.render(target))
+
+        # A large atlas zoomed in, where only the visible tiles are scaled
+        atlas = syntheticImage(0, 4096, 3)
+        editor.setOriginalImage(atlas)
+        editor.setImage(atlas)
+        editor.setZoom(8.0)
+        for j in range(32):
+            t.measure("ImageEditor.pan.4096", 1, lambda: (editor.panBy(QPoint(37, 23)), editor.render(target)))
+        for j in range(16):
+            t.measure("ImageEditor.zoom.4096", 1, lambda: (editor.setZoom(editor.zoom() * (1.25 if j % 2 == 0 else 0.8)), editor.render(target)))
+
+    return t.summary()
+
+def compare(results, previous):
+    for name in sorted(results):
+        if name in previous:
+            before = previous[name]["p50_ms"]
+            after = results[name]["p50_ms"]
+            change = (after - before) / before * 100.0 if before > 0 else 0.0
+            print("%-40s p50 %10.3f ms -> %10.3f ms (%+.1f%%)" % (name, before, after, change))
+        else:
+            print("%-40s p50 %10.3f ms (new)" % (name, results[name]["p50_ms"]))
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="benchmark", description="Sgt.Skinner hot path benchmarks")
+    parser.add_argument("--files", type=int, default=1000, help="textures in the synthetic jar and pack")
+    parser.add_argument("--size", type=int, default=16, help="texture width and height in pixels")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=200, help="textures used by the per-texture operations")
+    parser.add_argument("--editor", type=int, default=800, help="editor widget size in pixels")
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--compare", help="json results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    app = QApplication([])
+    # Jar caches go to Qt's test locations on every platform, not the user's cache, and every run starts cold
+    QStandardPaths.setTestModeEnabled(True)
+    from skindocument import cacheDir
+    shutil.rmtree(cacheDir(), ignore_errors=True)
+    with tempfile.TemporaryDirectory(prefix="sgtbench") as workdir:
+        results = run(args, workdir)
+
+    for name in sorted(results):
+        r = results[name]
+        print("%-40s runs %6d  p50 %10.3f ms  p90 %10.3f ms  p99 %10.3f ms  %12.1f items/s" % (name, r["runs"], r["p50_ms"], r["p90_ms"], r["p99_ms"], r["items_per_s"]))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f)["results"])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({ "config": vars(args), "results": results }, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,115 @@
+#! /bin/env python
+#
+#    Sgt.Skinner - A Minecraft skin editor
+#    Copyright (C) 2020 Johan Thelin
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Batch mode, runs the Document engine without QtWidgets or a display
+
+import sys
+import argparse
+
+from PySide2.QtCore import QCoreApplication
+
+from skindocument import Document
+
+def on_diff(args, document):
+    for pack in args.packs:
+        document.load(pack)
+        report = document.compareWithOriginals()
+        for status, fns in [("identical", report.duplicates), ("changed", report.changed), ("size", report.sizeMismatches), ("missing", report.missing)]:
+            for fn in sorted(fns):
+                print(status + "\t" + pack + "\t" + fn)
+    return 0
+
+def on_strip_duplicates(args, document):
+    for pack in args.packs:
+        document.load(pack)
+        report = document.removeDuplicates()
+        if args.dry_run:
+            for fn in sorted(report.duplicates):
+                print("duplicate\t" + pack + "\t" + fn)
+        else:
+            saveReport = document.save()
+            print(pack + ": " + report.summary() + " " + saveReport.summary())
+    return 0
+
+def on_validate(args, document):
+    res = 0
+    for pack in args.packs:
+        document.load(pack)
+        report = document.validate()
+        for fn, size, originalSize in report.sizeMismatches:
+            print("size\t%s\t%s\t%dx%d\t%dx%d" % (pack, fn, size[0], size[1], originalSize[0], originalSize[1]))
+        for status, fns in [("missing", report.missingOriginals), ("orphan", report.orphans), ("invalid", report.invalid)]:
+            for fn in fns:
+                print(status + "\t" + pack + "\t" + fn)
+        if not report.isValid():
+            res = 1
+    return res
+
+def on_export(args, document):
+    document.load(args.pack)
+    if args.destination.endswith(".zip"):
+        report = document.exportZip(args.destination, args.deflate)
+    else:
+        report = document.saveAs(args.destination)
+    print(args.pack + ": " + report.summary())
+    if len(report.failed) > 0:
+        return 1
+    else:
+        return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="sgtbatch", description="Sgt.Skinner batch mode")
+    parser.add_argument("--jar", action="append", help="minecraft.jar to compare against, repeat to add mod jars and asset folders overriding it")
+    parser.add_argument("--compression", type=int, default=-1, help="zlib level 0-9 for written pngs, -1 for Qt's default")
+    parser.add_argument("--no-palette", action="store_true", help="never write indexed pngs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("diff", help="list how each texture of the packs differs from the jar")
+    cmd.add_argument("packs", nargs="+")
+    cmd.set_defaults(func=on_diff, needsJar=True)
+
+    cmd = commands.add_parser("strip-duplicates", help="remove textures identical to the jar and save the packs")
+    cmd.add_argument("--dry-run", action="store_true", help="only list the duplicates")
+    cmd.add_argument("packs", nargs="+")
+    cmd.set_defaults(func=on_strip_duplicates, needsJar=True)
+
+    cmd = commands.add_parser("validate", help="report textures of the wrong size, not in the jar, orphaned files and broken pngs, from the png headers only")
+    cmd.add_argument("packs", nargs="+")
+    cmd.set_defaults(func=on_validate, needsJar=True)
+
+    cmd = commands.add_parser("export", help="write a copy of the pack to a new folder, or to a zip if the destination ends with .zip")
+    cmd.add_argument("--deflate", action="store_true", help="deflate the pngs in the zip instead of storing them")
+    cmd.add_argument("pack")
+    cmd.add_argument("destination")
+    cmd.set_defaults(func=on_export, needsJar=False)
+
+    args = parser.parse_args(argv)
+    if args.needsJar and not args.jar:
+        parser.error("--jar is required for " + args.command)
+
+    app = QCoreApplication([])
+    # The jars are indexed once and shared by all the packs of a run
+    document = Document(background = False)
+    document.pngCompression = args.compression
+    document.reducePalettes = not args.no_palette
+    if args.jar:
+        document.setMinecraftJars(args.jar)
+    return args.func(args, document)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -16,10 +16,17 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import time
+# Taken before the Qt imports, which dominate the start up time
+startupTimes = { "start": time.perf_counter() }
+
 import os
 import sys
-import pathlib
-import zipfile
+import re
+import bisect
+import fnmatch
+import argparse
+import collections
 
 from PySide2.QtWidgets import QApplication \
                             , QPushButton \
@@ -38,25 +45,34 @@ from PySide2.QtWidgets import QApplication \
                             , QLineEdit \
                             , QFileDialog \
                             , QMessageBox \
-                            , QSplitter
+                            , QSplitter \
+                            , QProgressDialog \
+                            , QSpinBox \
+                            , QDialog \
+                            , QTableWidget \
+                            , QTableWidgetItem \
+                            , QActionGroup
 from PySide2.QtGui import QIcon, QPixmap, QImage \
                         , QMouseEvent, QPaintEvent \
-                        , QPainter, QBrush \
+                        , QPainter, QBrush, QColor, QKeySequence \
                         , qRgba, qRed, qGreen, qBlue, qAlpha
-from PySide2.QtCore import Qt, Signal, QObject \
-                         , QRect, QPoint, QMargins, QSize \
-                         , QSortFilterProxyModel, QAbstractTableModel
+from PySide2.QtCore import Qt, Signal, QObject, QTimer \
+                         , QRect, QRectF, QPoint, QMargins, QSize \
+                         , QAbstractTableModel
+
+from skindocument import Document, imageBytes
+from skinprofile import profiler, profiled
+from skinundo import UndoHistory
 
-def findFilesInDir(path):
+startupTimes["imported"] = time.perf_counter()
+
+def startupReport():
+    start = startupTimes["start"]
     res = []
-    for dirName, dirList, fileList in os.walk(path):
-        dn = dirName.replace('\\', '/')
-        for f in fileList:
-            relfn = dn + '/' + f
-            if relfn.startswith(path):
-                relfn = relfn[len(path):]
-            res.append(relfn)
-    return res
+    for name in ["imported", "window", "painted", "interactive"]:
+        if name in startupTimes:
+            res.append("%s %.0f ms" % (name, (startupTimes[name] - start) * 1000.0))
+    return "Start up: " + ", ".join(res)
 
 class ColourBox(QWidget):
     colourPicked = Signal(int, int, int, int)
@@ -146,139 +162,114 @@ class ColourButton(QPushButton):
             self.colourChanged.emit(res.red(), res.green(), res.blue(), res.alpha())
             self._updateColour()
 
-class Document(QObject):
-    imageChanged = Signal(str)
-    allChanged = Signal()
-
-    def isSkin(path):
-        # TODO
-        # fileexists("pack.mcmeta")
-        # fileexists("pack.png")
-        # direxists("assets")
-        return True
+def linePoints(x0, y0, x1, y1):
+    # Bresenham, both end points included
+    res = []
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+        res.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            break
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+    return res
 
-    def isSkinOrEmpty(path):
-        # TODO
-        return True
+class ImageDelta:
+    # Edits are recorded as the before and after state of the changed tiles only
+    TILE = 16
 
     def __init__(self):
-        QObject.__init__(self)
-
-        self.jarFilename = ''
-        self._path = ''
-        self.zf = None
-        self._images = {}
-        self._isDirty = False
-
-    def clear(self):
-        self._images = {}
-        self._isDirty = False
-        self.allChanged.emit()
-
-    def isDirty(self):
-        return self._isDirty
-
-    def hasPath(self):
-        if self._path == '':
-            return False
+        self._tiles = []
+        self._whole = None
+
+    def isEmpty(self):
+        return len(self._tiles) == 0 and self._whole is None
+
+    def addTile(self, rect, before, after):
+        self._tiles.append((QRect(rect), before, after))
+
+    def setWhole(self, before, after):
+        self._whole = (before, after)
+
+    def sizeInBytes(self):
+        res = 0
+        for rect, before, after in self._tiles:
+            res += before.sizeInBytes() + after.sizeInBytes()
+        if self._whole is not None:
+            res += self._whole[0].sizeInBytes() + self._whole[1].sizeInBytes()
+        return res
+
+    def tileRects(image, rect):
+        res = []
+        t = ImageDelta.TILE
+        rect = rect.intersected(image.rect())
+        if rect.isEmpty():
+            return res
+        for ty in range(rect.top() // t, rect.bottom() // t + 1):
+            for tx in range(rect.left() // t, rect.right() // t + 1):
+                res.append(QRect(tx*t, ty*t, t, t).intersected(image.rect()))
+        return res
+
+    def between(before, after):
+        res = ImageDelta()
+        if before.size() != after.size():
+            res.setWhole(before.copy(), after.copy())
         else:
-            return True
-
-    def load(self, path):
-        self._path = path
-        self._images = {}
-        filesInAssets = findFilesInDir(path + "/assets/")
-        for fn in filesInAssets:
-            if fn.endswith(".png"):
-                self._images["pack.png"] = QImage(path + "/pack.png")
-                self._images["assets/" + fn] = QImage(path + "/assets/" + fn)
-        self._isDirty = False
-        self.allChanged.emit()
-
-    def save(self):
-        for fn in self._images:
-            destination = self._path + '/' + fn
-            path = pathlib.Path(destination)
-            path.parents[0].mkdir(parents=True, exist_ok=True)
-            self._images[fn].save(destination)
-        self._isDirty = False
-        self.allChanged.emit()
-
-    def removeDuplicates(self):
-        # TODO is this to be a part of saving, or something optional?
-        if self.zf:
-            dupes = []
-            for fn in self._images:
-                ni = self._images[fn]
-                if self.hasOriginalImage(fn):
-                    oi = self.getOriginalImage(fn)
-                    if oi.width() == ni.width() and oi.height() == ni.height():
-                        dupe = True
-                        for y in range(oi.height()):
-                            for x in range(oi.width()):
-                                if oi.pixel(x, y) != ni.pixel(x, y):
-                                    dupe = False
-                        if dupe:
-                            dupes.append(fn)
-                    else:
-                        print("FAILURE: " + fn + " mismatch in size.")
-                else:
-                    print("FAILURE: " + fn + " not in zip.")
-
-            for fn in dupes:
-                del self._images[fn]
-        else:
-            print("FAILURE: no zip loaded.")
-
-    def saveAs(self, path):
-        self._path = path
-        self.save()
-
-    def clearImage(self, filename):
-        if filename in self._images:
-            self._images.remove(filename)
-            self._isDirty = True
-
-    def setMinecraftJar(self, fn):
-        self.jarFilename = fn
-        self.zf = zipfile.ZipFile(fn, 'r')
-        self.allChanged.emit()
-
-    def hasOriginalImage(self, filename):
-        if self.zf:
-            return filename in self.zf.namelist()
-        else:
-            return False
-
-    def getOriginalImage(self, filename):
-        if self.zf:
-            return QImage.fromData(self.zf.read(filename))
-        else:
-            # TODO what about None, and hasOriginalImage?
-            return QImage(16, 16, QImage.Format_ARGB32)
-
-    def getImage(self, filename):
-        return self._images[filename]
-
-    def hasImage(self, filename):
-        if filename in self._images:
-            return True
-        else:
-            return False
+            for rect in ImageDelta.tileRects(before, before.rect()):
+                b = before.copy(rect)
+                a = after.copy(rect)
+                if imageBytes(b) != imageBytes(a):
+                    res.addTile(rect, b, a)
+        return res
+
+    def apply(self, image, undo):
+        # Returns the resulting image, which is the given one modified unless the size changed
+        if self._whole is not None:
+            if undo:
+                return self._whole[0].copy()
+            else:
+                return self._whole[1].copy()
+        p = QPainter(image)
+        p.setCompositionMode(QPainter.CompositionMode_Source)
+        for rect, before, after in self._tiles:
+            if undo:
+                p.drawImage(rect.topLeft(), before)
+            else:
+                p.drawImage(rect.topLeft(), after)
+        p.end()
+        return image
 
-    def setImage(self, filename, image):
-        self._images[filename] = image
-        self._isDirty = True
-        self.imageChanged.emit(filename)
+    def boundingRect(self):
+        res = QRect()
+        for rect, before, after in self._tiles:
+            res = res.united(rect)
+        return res
 
 class ImageEditor(QFrame):
     colourPicked = Signal(int, int, int, int)
     colourChanged = Signal(int, int, int, int)
+    strokeFinished = Signal(object)
 
     # Tools (operating modes)
     MODE_DRAW = 0
     MODE_COLOURPICKER = 1
 
+    # Scaled layers are cached as tiles of the scaled image, so only the visible part is ever scaled
+    TILE_SIZE = 256
+    MAX_TILES = 512
+    # Widget pixels per texel, and the change per wheel step
+    MAX_ZOOM = 64.0
+    ZOOM_STEP = 1.25
+
     def __init__(self):
         QFrame.__init__(self)
 
@@ -295,11 +286,29 @@ class ImageEditor(QFrame):
 
         self._imageIsDirty = False
         self._drawing = False
+        self._lastTexel = None
+        self._strokeTiles = None
+        self._brushSize = 1
         self._colour = qRgba(0, 0, 0, 255)
         self._mode = ImageEditor.MODE_DRAW
 
+        # Checkerboard tile shown behind transparent texels
+        tile = QPixmap(32, 32)
+        tile.fill(Qt.white)
+        tp = QPainter(tile)
+        tp.fillRect(0, 0, 16, 16, Qt.lightGray)
+        tp.fillRect(16, 16, 16, 16, Qt.lightGray)
+        tp.end()
+        self._checkerBrush = QBrush(tile)
+
+        # Widget pixels per texel, None fits the whole image to the widget
+        self._zoom = None
+        self._scale = 1.0
+        # The scaled image in widget coordinates, larger than the widget when zoomed in
+        self._imageRect = QRect()
+        self._tiles = collections.OrderedDict()
+        self._panStart = None
         self._updateImagePosition()
-        self._updateOriginalAlphaImage()
 
     def setMode(self, m):
         self._drawing = False
@@ -314,38 +323,158 @@ class ImageEditor(QFrame):
         self._colour = c
         self.colourChanged.emit(r, g, b, a)
 
-    def _updateImagePosition(self):
-        hfromw = int((float(self.width()-2) / float(self._originalImage.width())) * self._originalImage.height())
-        wfromh = int((float(self.height()-2) /float(self._originalImage.height())) * self._originalImage.width())
+    def setBrushSize(self, size):
+        self._brushSize = max(1, size)
 
-        if wfromh > self.width()-2:
-            width = self.width()-2
-            height = hfromw
-        else:
-            width = wfromh
-            height = self.height()-2
+    def _viewRect(self):
+        return QRect(1, 1, self.width()-2, self.height()-2)
 
-        xoffset = (self.width() - 2 - width)/2+1
-        yoffset = (self.height() - 2 - height)/2+1
+    def _fitScale(self):
+        view = self._viewRect()
+        return min(view.width() / self._originalImage.width(), view.height() / self._originalImage.height())
 
-        self._imageRect = QRect(xoffset, yoffset, width, height)
+    def zoom(self):
+        return self._scale
 
-    def _updateOriginalAlphaImage(self):
-        tempImage = self._originalImage.copy()
-        for y in range(tempImage.height()):
-            for x in range(tempImage.width()):
-                pixel = tempImage.pixel(x,y)
-                tempImage.setPixel(x, y, qRgba(qRed(pixel), qGreen(pixel), qBlue(pixel), qAlpha(pixel)*self._originalAlpha/255.0))
-        self._originalAlphaImage = tempImage
+    def setZoom(self, zoom, anchor = None):
+        # The texel under anchor, the centre by default, stays in place, zooming out past the fit fits
+        if zoom is not None:
+            zoom = min(zoom, ImageEditor.MAX_ZOOM)
+            if zoom <= self._fitScale():
+                zoom = None
+        self._zoom = zoom
+        self._updateImagePosition(anchor)
+        self.update()
+
+    def zoomIn(self):
+        self.setZoom(self._scale * ImageEditor.ZOOM_STEP)
+
+    def zoomOut(self):
+        self.setZoom(self._scale / ImageEditor.ZOOM_STEP)
+
+    def zoomToFit(self):
+        self.setZoom(None)
+
+    def _updateImagePosition(self, anchor = None):
+        view = self._viewRect()
+        self._scale = self._fitScale() if self._zoom is None else self._zoom
+        width = max(1, int(self._originalImage.width() * self._scale))
+        height = max(1, int(self._originalImage.height() * self._scale))
+
+        # Keep the anchor over the same part of the image, then keep the image centred or covering the view
+        if anchor is None:
+            anchor = view.center()
+        old = self._imageRect
+        fx = (anchor.x() - old.left()) / old.width() if old.width() > 0 else 0.5
+        fy = (anchor.y() - old.top()) / old.height() if old.height() > 0 else 0.5
+        x = ImageEditor._clampOffset(int(round(anchor.x() - fx * width)), width, view.left(), view.width())
+        y = ImageEditor._clampOffset(int(round(anchor.y() - fy * height)), height, view.top(), view.height())
+
+        if old.size() != QSize(width, height):
+            self._invalidateScaledLayers()
+        self._imageRect = QRect(x, y, width, height)
+
+    def _clampOffset(offset, size, viewStart, viewSize):
+        if size <= viewSize:
+            return viewStart + (viewSize - size) // 2
+        return min(viewStart, max(viewStart + viewSize - size, offset))
+
+    def panBy(self, delta):
+        self._imageRect.translate(delta)
+        self._updateImagePosition()
+        self.update()
+
+    def _invalidateScaledLayers(self, layer = None):
+        # Tiles stay valid while panning, but not once the scaled size or the images change
+        if layer is None:
+            self._tiles.clear()
+        else:
+            for key in [key for key in self._tiles if key[0] == layer]:
+                del self._tiles[key]
+
+    def _scaledToTexel(offset, scaledSize, texels):
+        # The texel under the centre of a scaled pixel, as Qt samples it, also for offsets outside the image
+        return (2 * offset + 1) * texels // (2 * scaledSize)
+
+    def _scaledStart(texel, scaledSize, texels):
+        # The first scaled pixel whose centre lies in the texel
+        return (2 * texel * scaledSize + texels - 1) // (2 * texels)
+
+    def _texelsToScaled(self, texels, image):
+        # Both layers are scaled to the image rect, even when their sizes differ
+        r = self._imageRect
+        x0 = ImageEditor._scaledStart(texels.left(), r.width(), image.width())
+        x1 = ImageEditor._scaledStart(texels.right() + 1, r.width(), image.width())
+        y0 = ImageEditor._scaledStart(texels.top(), r.height(), image.height())
+        y1 = ImageEditor._scaledStart(texels.bottom() + 1, r.height(), image.height())
+        return QRect(x0, y0, x1 - x0, y1 - y0)
+
+    def _tileRects(self, scaled):
+        # (key, rect) of the tiles covering a rect of the scaled image
+        bounds = scaled.intersected(QRect(QPoint(0, 0), self._imageRect.size()))
+        if bounds.isEmpty():
+            return
+        size = ImageEditor.TILE_SIZE
+        for ty in range(bounds.top() // size, bounds.bottom() // size + 1):
+            for tx in range(bounds.left() // size, bounds.right() // size + 1):
+                yield (tx, ty), QRect(tx * size, ty * size, size, size).intersected(QRect(QPoint(0, 0), self._imageRect.size()))
+
+    def _tile(self, layer, key, rect):
+        tile = self._tiles.get((layer, key))
+        if tile is not None:
+            self._tiles.move_to_end((layer, key))
+            return tile
+
+        # Scale only the texels under the tile
+        profiler.count("ImageEditor.tileRendered")
+        image = self._originalImage if layer == "orig" else self._image
+        texels = QRect(QPoint(ImageEditor._scaledToTexel(rect.left(), self._imageRect.width(), image.width()), ImageEditor._scaledToTexel(rect.top(), self._imageRect.height(), image.height()))
+                     , QPoint(ImageEditor._scaledToTexel(rect.right(), self._imageRect.width(), image.width()), ImageEditor._scaledToTexel(rect.bottom(), self._imageRect.height(), image.height())))
+        texels = texels.adjusted(-1, -1, 1, 1).intersected(image.rect())
+        tile = QImage(rect.size(), QImage.Format_ARGB32_Premultiplied)
+        tile.fill(Qt.transparent)
+        p = QPainter(tile)
+        p.setCompositionMode(QPainter.CompositionMode_Source)
+        # One transform for the whole image, so every tile samples texels where _scaledToTexel says
+        p.translate(-rect.left(), -rect.top())
+        p.scale(self._imageRect.width() / image.width(), self._imageRect.height() / image.height())
+        p.drawImage(QRectF(texels), image, QRectF(texels))
+        p.end()
+        if layer == "orig":
+            tile = QPixmap.fromImage(tile)
+
+        self._tiles[(layer, key)] = tile
+        while len(self._tiles) > ImageEditor.MAX_TILES:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _imageChangedIn(self, texels):
+        # Drop the tiles under the changed texels and repaint only those texels, with a pixel of slack for the scaling
+        target = self._texelsToScaled(texels, self._image).adjusted(-1, -1, 1, 1)
+        for key, rect in list(self._tileRects(target)):
+            self._tiles.pop(("image", key), None)
+        self.update(target.translated(self._imageRect.topLeft()))
 
     def setImage(self, img):
         self._image = img.convertToFormat(QImage.Format_ARGB32).copy()
         self._imageIsDirty = False
+        self._invalidateScaledLayers("image")
         self.update()
 
     def image(self):
         return self._image
 
+    def applyDelta(self, delta, undo):
+        self._strokeTiles = None
+        image = delta.apply(self._image, undo)
+        self._imageIsDirty = True
+        if image is self._image:
+            self._imageChangedIn(delta.boundingRect())
+        else:
+            self._image = image.convertToFormat(QImage.Format_ARGB32)
+            self._invalidateScaledLayers("image")
+            self.update()
+
     def setOriginalImage(self, img):
         if img.format() == QImage.Format_ARGB32:
             self._originalImage = img
@@ -354,8 +483,8 @@ class ImageEditor(QFrame):
         self._image = QImage(self._originalImage.width(), self._originalImage.height(), QImage.Format_RGBA8888)
         self._image.fill(Qt.transparent)
         self._imageIsDirty = False
+        self._invalidateScaledLayers()
         self._updateImagePosition()
-        self._updateOriginalAlphaImage()
         self.update()
 
     def imageIsDirty(self):
@@ -367,13 +496,14 @@ class ImageEditor(QFrame):
 
     def setOriginalAlpha(self, value):
         self._originalAlpha = value
-        self._updateOriginalAlphaImage()
         self.update()
 
-    def _widgetToImagePos(self, widgetpos):
+    def _widgetToImagePos(self, widgetpos, image = None):
+        if image is None:
+            image = self._image
         pixelPos = widgetpos - self._imageRect.topLeft()
-        pixelX = int(float(pixelPos.x())/float(self._imageRect.width())*float(self._originalImage.width()))
-        pixelY = int(float(pixelPos.y())/float(self._imageRect.width())*float(self._originalImage.width()))
+        pixelX = ImageEditor._scaledToTexel(pixelPos.x(), self._imageRect.width(), image.width())
+        pixelY = ImageEditor._scaledToTexel(pixelPos.y(), self._imageRect.height(), image.height())
         return QPoint(pixelX, pixelY)
 
     def _getPixel(self, pos):
@@ -383,65 +513,125 @@ class ImageEditor(QFrame):
         return qRgba(0, 0, 0, 0)
 
     def _getOriginalPixel(self, pos):
-        imagePos = self._widgetToImagePos(pos)
-        if self._image.rect().contains(imagePos):
+        imagePos = self._widgetToImagePos(pos, self._originalImage)
+        if self._originalImage.rect().contains(imagePos):
             return self._originalImage.pixel(imagePos)
         return qRgba(0, 0, 0, 0)
 
-    def _putPixel(self, pos):
+    @profiled("ImageEditor.stroke")
+    def _strokeTo(self, pos, colour):
+        # Fill the brush along the line from the previous sample, so fast strokes leave no gaps
         imagePos = self._widgetToImagePos(pos)
-        if self._image.rect().contains(imagePos):
-            self._image.setPixel(imagePos, self._colour)
-            self._imageIsDirty = True
-            self.update()
+        if self._lastTexel is None:
+            points = [(imagePos.x(), imagePos.y())]
+        else:
+            points = linePoints(self._lastTexel.x(), self._lastTexel.y(), imagePos.x(), imagePos.y())
+        self._lastTexel = imagePos
+
+        offset = (self._brushSize - 1) // 2
+        xs = [x for x, y in points]
+        ys = [y for x, y in points]
+        dirty = QRect(min(xs) - offset, min(ys) - offset, max(xs) - min(xs) + self._brushSize, max(ys) - min(ys) + self._brushSize)
+        dirty = dirty.intersected(self._image.rect())
+        if dirty.isEmpty():
+            return
 
-    def _clearPixel(self, pos):
-        imagePos = self._widgetToImagePos(pos)
-        if self._image.rect().contains(imagePos):
-            self._image.setPixel(imagePos, qRgba(0, 0, 0, 0))
-            self._imageIsDirty = True
-            self.update()
+        if self._strokeTiles is not None:
+            for rect in ImageDelta.tileRects(self._image, dirty):
+                key = (rect.x(), rect.y())
+                if key not in self._strokeTiles:
+                    self._strokeTiles[key] = (rect, self._image.copy(rect))
 
+        p = QPainter(self._image)
+        p.setCompositionMode(QPainter.CompositionMode_Source)
+        c = QColor.fromRgba(colour)
+        for x, y in points:
+            p.fillRect(x - offset, y - offset, self._brushSize, self._brushSize, c)
+        p.end()
+
+        self._imageIsDirty = True
+        self._imageChangedIn(dirty)
+
+    @profiled("ImageEditor.paintEvent")
     def paintEvent(self, event):
         QFrame.paintEvent(self, event)
 
         p = QPainter(self)
 
-        p.fillRect(QRect(1, 1, self.width()-2, self.height()-2), Qt.darkGray)
-        p.fillRect(self._imageRect, Qt.white)
-        for y in range(int(self._imageRect.height() / 16.0)+1):
-            for x in range(int(self._imageRect.width() / 16.0)+1):
-                if (x+y) % 2 == 0:
-                    r = QRect(self._imageRect.left() + x*16, self._imageRect.top() + y*16, 16, 16)
-                    r = self._imageRect.intersected(r)
-                    p.fillRect(r, Qt.lightGray)
+        # Painting is clipped to the damaged region, so only the tiles under it are drawn
+        visible = self._imageRect.intersected(self._viewRect()).intersected(event.rect())
+        p.setClipRect(self._viewRect())
+        p.fillRect(self._viewRect(), Qt.darkGray)
+        p.setBrushOrigin(self._imageRect.topLeft())
+        p.fillRect(visible, self._checkerBrush)
+        if visible.isEmpty():
+            return
 
+        tiles = list(self._tileRects(visible.translated(-self._imageRect.topLeft())))
         if not self._originalOnTop:
-            p.drawImage(self._imageRect, self._originalAlphaImage)
-        p.drawImage(self._imageRect, self._image)
+            self._drawOriginal(p, tiles)
+        for key, rect in tiles:
+            p.drawImage(rect.topLeft() + self._imageRect.topLeft(), self._tile("image", key, rect))
         if self._originalOnTop:
-            p.drawImage(self._imageRect, self._originalAlphaImage)
+            self._drawOriginal(p, tiles)
+
+    def _drawOriginal(self, p, tiles):
+        # The painter applies the alpha while compositing, no per-pixel copy needed
+        if self._originalAlpha > 0:
+            p.setOpacity(self._originalAlpha / 255.0)
+            for key, rect in tiles:
+                p.drawPixmap(rect.topLeft() + self._imageRect.topLeft(), self._tile("orig", key, rect))
+            p.setOpacity(1.0)
 
     def resizeEvent(self, event):
         self._updateImagePosition()
 
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120.0
+        if steps != 0:
+            self.setZoom(self._scale * ImageEditor.ZOOM_STEP ** steps, event.pos())
+
+    def _finishStroke(self):
+        if self._strokeTiles is None:
+            return
+        delta = ImageDelta()
+        for rect, before in self._strokeTiles.values():
+            after = self._image.copy(rect)
+            if imageBytes(before) != imageBytes(after):
+                delta.addTile(rect, before, after)
+        self._strokeTiles = None
+        if not delta.isEmpty():
+            self.strokeFinished.emit(delta)
+
     def mousePressEvent(self, event):
-        if self._mode == ImageEditor.MODE_DRAW:
+        if event.button() == Qt.MiddleButton:
+            self._panStart = event.pos()
+        elif self._mode == ImageEditor.MODE_DRAW:
+            self._lastTexel = None
+            self._strokeTiles = {}
             if event.button() == Qt.LeftButton:
                 self._drawing = True
-                self._putPixel(event.pos())
+                self._strokeTo(event.pos(), self._colour)
             else:
                 self._drawing = False
-                self._clearPixel(event.pos())
+                self._strokeTo(event.pos(), qRgba(0, 0, 0, 0))
 
     def mouseMoveEvent(self, event):
-        if self._mode == ImageEditor.MODE_DRAW:
+        if self._panStart is not None:
+            self.panBy(event.pos() - self._panStart)
+            self._panStart = event.pos()
+        elif self._mode == ImageEditor.MODE_DRAW:
             if self._drawing:
-                self._putPixel(event.pos())
+                self._strokeTo(event.pos(), self._colour)
             else:
-                self._clearPixel(event.pos())
+                self._strokeTo(event.pos(), qRgba(0, 0, 0, 0))
 
     def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MiddleButton:
+            self._panStart = None
+            return
+        self._lastTexel = None
+        self._finishStroke()
         if self._mode == ImageEditor.MODE_COLOURPICKER:
             if event.button() == Qt.LeftButton:
                 # TODO, mix the two colours from original and image...
@@ -450,17 +640,64 @@ class ImageEditor(QFrame):
                 res = self._getOriginalPixel(event.pos())
             self.colourPicked.emit(qRed(res), qGreen(res), qBlue(res), qAlpha(res))
 
+class PathIndex:
+    # All paths joined into one string, so a substring search runs in str.find rather than per row
+    def __init__(self, paths):
+        self._paths = paths
+        self._text = "\n".join(paths) + "\n"
+        self._starts = []
+        pos = 0
+        for p in paths:
+            self._starts.append(pos)
+            pos += len(p) + 1
+        self._lastQuery = None
+        self._lastRows = None
+
+    def search(self, query):
+        # Sorted row numbers of the paths matching, * ? and [] work as wildcards
+        if query == '':
+            rows = list(range(len(self._paths)))
+        elif any(c in query for c in "*?["):
+            regexp = re.compile(fnmatch.translate("*" + query + "*"))
+            rows = [i for i in range(len(self._paths)) if regexp.match(self._paths[i])]
+        elif self._lastQuery is not None and self._lastQuery != '' and self._lastQuery in query:
+            # Typing narrows the previous result, only those rows need checking
+            rows = [i for i in self._lastRows if query in self._paths[i]]
+        elif self._text.count(query) > len(self._paths) // 8:
+            # Most rows match, walking the hits one by one would cost more than checking every row
+            rows = [i for i in range(len(self._paths)) if query in self._paths[i]]
+        else:
+            rows = []
+            pos = self._text.find(query)
+            while pos >= 0:
+                row = bisect.bisect_right(self._starts, pos) - 1
+                rows.append(row)
+                if row + 1 >= len(self._starts):
+                    break
+                pos = self._text.find(query, self._starts[row + 1])
+        if any(c in query for c in "*?["):
+            self._lastQuery = None
+        else:
+            self._lastQuery = query
+        self._lastRows = rows
+        return rows
+
 class DocumentModel(QAbstractTableModel):
     FilePathRole = Qt.UserRole+1
 
     def __init__(self, document):
         QAbstractTableModel.__init__(self)
 
+        self._allFns = []
+        self._index = PathIndex([])
+        self._filterText = ''
         self._fns = []
+        self._rows = {}
 
         self._document = document
         self._document.allChanged.connect(self.on_all_changed)
         self._document.imageChanged.connect(self.on_image_changed)
+        self._document.thumbnailsReady.connect(self.on_thumbnails_ready)
 
     def columnCount(self, parent):
         if not parent.isValid():
@@ -474,18 +711,17 @@ class DocumentModel(QAbstractTableModel):
         else:
             return 0
 
+    @profiled("DocumentModel.data")
     def data(self, index, role):
         fn = self._fns[index.row()]
         if index.column() == 0:
             if role == Qt.DecorationRole:
-                if self._document.hasOriginalImage(fn):
-                    return self._document.getOriginalImage(fn).scaled(32, 32, Qt.KeepAspectRatio)
+                return self._document.originalThumbnail(fn)
             elif role == Qt.SizeHintRole:
                 return QSize(32, 32)
         elif index.column() == 1:
             if role == Qt.DecorationRole:
-                if self._document.hasImage(fn):
-                    return self._document.getImage(fn).scaled(32, 32, Qt.KeepAspectRatio)
+                return self._document.thumbnail(fn)
             elif role == Qt.SizeHintRole:
                 return QSize(32, 32)
         else: # index.column() == 2:
@@ -504,15 +740,97 @@ class DocumentModel(QAbstractTableModel):
 
     def on_all_changed(self):
         self.beginResetModel()
-        if self._document.zf:
-            self._fns = list(filter(lambda x: x.endswith(".png"), self._document.zf.namelist()))
-        else:
-            self._fns = []
+        # The document keeps the sorted list until the jars change, so skin loads reuse the index
+        fns = self._document.originalFilenames()
+        if fns is not self._allFns:
+            self._allFns = fns
+            self._index = PathIndex(fns)
+        self._applyFilter()
         self.endResetModel()
 
+    def setFilterText(self, text):
+        if text == self._filterText:
+            return
+        self._filterText = text
+        self.beginResetModel()
+        self._applyFilter()
+        self.endResetModel()
+
+    def _applyFilter(self):
+        self._fns = [self._allFns[i] for i in self._index.search(self._filterText)]
+        self._rows = {fn: row for row, fn in enumerate(self._fns)}
+
     def on_image_changed(self, fn):
-        pass #TODO
-        print("IMG " + fn)
+        if fn in self._rows:
+            index = self.index(self._rows[fn], 1)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def on_thumbnails_ready(self, fns):
+        rows = [self._rows[fn] for fn in fns if fn in self._rows]
+        if len(rows) > 0:
+            self.dataChanged.emit(self.index(min(rows), 0), self.index(max(rows), 1), [Qt.DecorationRole])
+
+class PerformanceDialog(QDialog):
+    def __init__(self, parent):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Performance")
+        self.resize(600, 400)
+        self.setLayout(QVBoxLayout())
+
+        enabled = QCheckBox("Collect timings")
+        enabled.setChecked(profiler.enabled)
+        enabled.toggled.connect(profiler.setEnabled)
+
+        self._table = QTableWidget(0, 5)
+        self._table.setHorizontalHeaderLabels(["Name", "Calls", "Total ms", "Mean ms", "Max ms"])
+        self._table.verticalHeader().setVisible(False)
+
+        buttons = QWidget()
+        buttons.setLayout(QHBoxLayout())
+        resetButton = QPushButton("Reset")
+        resetButton.clicked.connect(self.on_reset)
+        traceButton = QPushButton("Save Trace")
+        traceButton.clicked.connect(self.on_save_trace)
+        buttons.layout().addWidget(resetButton)
+        buttons.layout().addWidget(traceButton)
+
+        self.layout().addWidget(enabled)
+        self.layout().addWidget(self._table)
+        self.layout().addWidget(buttons)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(500)
+        self._timer.timeout.connect(self._updateStats)
+
+    def showEvent(self, event):
+        self._updateStats()
+        self._timer.start()
+
+    def hideEvent(self, event):
+        self._timer.stop()
+
+    def _updateStats(self):
+        rows = profiler.stats()
+        self._table.setRowCount(len(rows))
+        for r in range(len(rows)):
+            for c in range(5):
+                value = rows[r][c]
+                if value is None:
+                    text = ''
+                elif isinstance(value, float):
+                    text = "%.2f" % value
+                else:
+                    text = str(value)
+                self._table.setItem(r, c, QTableWidgetItem(text))
+
+    def on_reset(self):
+        profiler.reset()
+        self._updateStats()
+
+    def on_save_trace(self):
+        fn, flt = QFileDialog.getSaveFileName(self, "Save trace", "sgtskinner-trace.json", "Trace (*.json)")
+        if fn != '':
+            profiler.dumpTrace(fn)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -520,6 +838,14 @@ class MainWindow(QMainWindow):
 
         self.currentFilename = ''
         self.document = Document()
+        self.document.progress.connect(self.on_document_progress)
+        self.document.filesReloaded.connect(self.on_files_reloaded)
+        self.document.setWatching(True)
+        self.history = UndoHistory()
+        self._performanceDialog = None
+        self._progressDialog = None
+        # Jars and skin to open once the window has painted, see openAfterPaint()
+        self._initialOpen = None
 
         fileMenu = self.menuBar().addMenu("&File")
         fileMenu.addAction("New Skin", self.on_file_new_skin)
@@ -527,13 +853,46 @@ class MainWindow(QMainWindow):
         fileMenu.addAction("Open Skin", self.on_file_open_skin)
         fileMenu.addAction("Save Skin", self.on_file_save_skin)
         fileMenu.addAction("Save Skin As", self.on_file_save_skin_as)
+        fileMenu.addAction("Export Skin Zip", self.on_file_export_zip)
+        watchSkin = fileMenu.addAction("Watch Skin Folder")
+        watchSkin.setCheckable(True)
+        watchSkin.setChecked(self.document.isWatching())
+        watchSkin.toggled.connect(self.document.setWatching)
         fileMenu.addSeparator()
         fileMenu.addAction("Open minecraft.jar", self.on_file_open_minecraft)
+        fileMenu.addAction("Add Mod Jar", self.on_file_add_mod_jar)
+        fileMenu.addAction("Add Asset Folder", self.on_file_add_asset_folder)
         fileMenu.addSeparator()
         fileMenu.addAction("Quit", self.on_file_quit)
 
+        editMenu = self.menuBar().addMenu("&Edit")
+        editMenu.addAction("Undo", self.on_edit_undo, QKeySequence.Undo)
+        editMenu.addAction("Redo", self.on_edit_redo, QKeySequence.Redo)
+
+        viewMenu = self.menuBar().addMenu("&View")
+        viewMenu.addAction("Zoom In", lambda: self.editor.zoomIn(), QKeySequence.ZoomIn)
+        viewMenu.addAction("Zoom Out", lambda: self.editor.zoomOut(), QKeySequence.ZoomOut)
+        viewMenu.addAction("Fit to Window", lambda: self.editor.zoomToFit(), QKeySequence("Ctrl+0"))
+
         toolsMenu = self.menuBar().addMenu("&Tools")
         toolsMenu.addAction("Remove duplicates", self.on_tools_remove_duplicates)
+        toolsMenu.addAction("Validate skin", self.on_tools_validate)
+        toolsMenu.addSeparator()
+        reducePalettes = toolsMenu.addAction("Reduce PNG palettes")
+        reducePalettes.setCheckable(True)
+        reducePalettes.setChecked(self.document.reducePalettes)
+        reducePalettes.toggled.connect(self.on_tools_reduce_palettes)
+        compressionMenu = toolsMenu.addMenu("PNG compression")
+        compressionGroup = QActionGroup(self)
+        for level in range(-1, 10):
+            action = compressionMenu.addAction("Default" if level < 0 else str(level))
+            action.setCheckable(True)
+            action.setChecked(level == self.document.pngCompression)
+            action.setData(level)
+            compressionGroup.addAction(action)
+        compressionGroup.triggered.connect(self.on_tools_png_compression)
+        toolsMenu.addSeparator()
+        toolsMenu.addAction("Performance", self.on_tools_performance)
 
         root = QSplitter()
 
@@ -541,13 +900,9 @@ class MainWindow(QMainWindow):
         leftRoot.setLayout(QVBoxLayout())
         
         treeView = QTreeView()
+        # The model is kept sorted and filters itself, a proxy would call data() for every row
         self.model = DocumentModel(self.document)
-        self.filterModel = QSortFilterProxyModel()
-        self.filterModel.setSortRole(DocumentModel.FilePathRole)
-        self.filterModel.sort(0)
-        self.filterModel.setFilterRole(DocumentModel.FilePathRole)
-        self.filterModel.setSourceModel(self.model)
-        treeView.setModel(self.filterModel)
+        treeView.setModel(self.model)
         treeView.setAllColumnsShowFocus(True)
         treeView.setColumnWidth(0, 64)
         treeView.setColumnWidth(1, 32)
@@ -557,12 +912,18 @@ class MainWindow(QMainWindow):
         self.textFilter = QLineEdit()
         self.textFilter.setPlaceholderText("Enter Filter Text")
         self.textFilter.textChanged.connect(self.on_filter_text_changed)
+        # Filter once typing pauses, not on every keystroke
+        self.filterTimer = QTimer(self)
+        self.filterTimer.setSingleShot(True)
+        self.filterTimer.setInterval(150)
+        self.filterTimer.timeout.connect(self.on_filter_timeout)
 
         leftRoot.layout().addWidget(treeView)
         leftRoot.layout().addWidget(self.textFilter)
 
         self.editor = ImageEditor()
         self.editor.colourPicked.connect(self.on_colour_picked)
+        self.editor.strokeFinished.connect(self.on_stroke_finished)
 
         rightRoot = QWidget()
         rightRoot.setLayout(QVBoxLayout())
@@ -586,8 +947,14 @@ class MainWindow(QMainWindow):
         self.toolDraw.toggled.connect(self.on_tool_changed)
         self.toolPick.toggled.connect(self.on_tool_changed)
 
+        brushSize = QSpinBox()
+        brushSize.setRange(1, 32)
+        brushSize.setPrefix("Brush ")
+        brushSize.valueChanged[int].connect(self.editor.setBrushSize)
+
         toolsRoot.layout().addWidget(self.toolDraw)
         toolsRoot.layout().addWidget(self.toolPick)
+        toolsRoot.layout().addWidget(brushSize)
 
         sliderOriginalAlpha = QSlider(Qt.Horizontal)
         sliderOriginalAlpha.setRange(0, 255)
@@ -624,10 +991,39 @@ class MainWindow(QMainWindow):
         if self.document.hasImage(self.currentFilename):
             self.editor.setImage(self.document.getImage(self.currentFilename))
 
+    def on_files_reloaded(self, fns):
+        # Unsynced edits in the editor win over the file on disk, any other undo steps no longer apply
+        for fn in fns:
+            if fn != self.currentFilename or not self.editor.imageIsDirty():
+                self.history.clearFile(fn)
+        if self.currentFilename in fns and not self.editor.imageIsDirty():
+            if self.document.hasImage(self.currentFilename):
+                self.editor.setImage(self.document.getImage(self.currentFilename))
+            else:
+                # Deleted on disk, back to the original with nothing painted over it
+                self.editor.setOriginalImage(self.document.getOriginalImage(self.currentFilename))
+        self.statusBar().showMessage("Reloaded %d changed files" % len(fns), 5000)
+
     def on_copy_original(self):
         if self.currentFilename != '':
-            self.document.setImage(self.currentFilename, self.document.getOriginalImage(self.currentFilename))
+            before = self.editor.image()
+            self.document.copyOriginal(self.currentFilename)
             self.editor.setImage(self.document.getOriginalImage(self.currentFilename))
+            self.history.push(self.currentFilename, ImageDelta.between(before, self.editor.image()))
+
+    def on_stroke_finished(self, delta):
+        if self.currentFilename != '':
+            self.history.push(self.currentFilename, delta)
+
+    def on_edit_undo(self):
+        delta = self.history.undo(self.currentFilename)
+        if delta is not None:
+            self.editor.applyDelta(delta, True)
+
+    def on_edit_redo(self):
+        delta = self.history.redo(self.currentFilename)
+        if delta is not None:
+            self.editor.applyDelta(delta, False)
 
     def on_tool_changed(self):
         if self.toolPick.isChecked():
@@ -639,11 +1035,27 @@ class MainWindow(QMainWindow):
         self.editor.setColour(r, g, b, a)
 
     def on_filter_text_changed(self):
-        text = self.textFilter.text().strip()
-        if len(text) == 0:
-            self.filterModel.setFilterWildcard("*")
-        else:
-            self.filterModel.setFilterWildcard("*" + text + "*")
+        self.filterTimer.start()
+
+    def on_filter_timeout(self):
+        self.model.setFilterText(self.textFilter.text().strip())
+
+    def _runWithProgress(self, label, operation):
+        self._progressDialog = QProgressDialog(label, "Cancel", 0, 0, self)
+        self._progressDialog.setWindowModality(Qt.WindowModal)
+        self._progressDialog.setMinimumDuration(500)
+        self._progressDialog.canceled.connect(self.document.cancel)
+        try:
+            return operation()
+        finally:
+            self._progressDialog.close()
+            self._progressDialog = None
+
+    def on_document_progress(self, operation, done, total):
+        if self._progressDialog is not None:
+            # A window modal dialog processes events in setValue, keeping the window responsive
+            self._progressDialog.setMaximum(total)
+            self._progressDialog.setValue(done)
 
     def _maybeSave(self):
         self._syncImageToDocument()
@@ -657,19 +1069,23 @@ class MainWindow(QMainWindow):
 
     def on_file_new_skin(self):
         if self._maybeSave():
+            self.history.clear()
             self.document.clear()
 
     def on_file_open_skin(self):
         path = QFileDialog.getExistingDirectory(self, "Open skin", 'C:\\Users\\Thelin\\Documents\\Johans\\coding\\sgskinner\\testing\\Eriks_Resource_Pack')
         if path != '' and Document.isSkin(path):
             if self._maybeSave():
-                self.document.load(path)
+                # A cancelled load leaves the open skin, and its undo history, as they were
+                if self._runWithProgress("Loading skin...", lambda: self.document.load(path)):
+                    self.history.clear()
 
     def on_file_save_skin(self):
         if self.document.hasPath():
             self._syncImageToDocument()
-            self.document.save()
-            return True
+            report = self._runWithProgress("Saving skin...", self.document.save)
+            self.statusBar().showMessage(report.summary(), 5000)
+            return len(report.failed) == 0
         else:
             return self.on_file_save_skin_as()
 
@@ -677,31 +1093,112 @@ class MainWindow(QMainWindow):
         path = QFileDialog.getExistingDirectory(self, "Save skin", 'C:/Users/Thelin/Documents/Johans/coding/sgskinner/testing/skin')
         if path != '' and Document.isSkinOrEmpty(path):
             self._syncImageToDocument()
-            self.document.saveAs(path)
-            return True
+            report = self._runWithProgress("Saving skin...", lambda: self.document.saveAs(path))
+            self.statusBar().showMessage(report.summary(), 5000)
+            return len(report.failed) == 0
         else:
             return False
 
+    def on_file_export_zip(self):
+        fn, flt = QFileDialog.getSaveFileName(self, "Export skin", '', "Resource pack (*.zip)")
+        if fn != '':
+            self._syncImageToDocument()
+            report = self._runWithProgress("Exporting skin...", lambda: self.document.exportZip(fn))
+            self.statusBar().showMessage(report.summary(), 5000)
+
     def on_file_open_minecraft(self):
         fn, flt = QFileDialog.getOpenFileName(self, "Open minecraft.jar", 'C:/Users/Thelin/AppData/Roaming/.technic/modpacks/vanilla/bin/', "Minecraft (minecraft.jar)")
         if fn != '':
             self.document.setMinecraftJar(fn)
 
+    def on_file_add_mod_jar(self):
+        # Textures of mods added later override those of earlier ones
+        fn, flt = QFileDialog.getOpenFileName(self, "Add mod jar", '', "Mods (*.jar *.zip)")
+        if fn != '':
+            self.document.addMinecraftJar(fn)
+
+    def on_file_add_asset_folder(self):
+        fn = QFileDialog.getExistingDirectory(self, "Add asset folder")
+        if fn != '':
+            self.document.addMinecraftJar(fn)
+
     def on_file_quit(self):
         if self._maybeSave():
             self.close()
 
     def on_tools_remove_duplicates(self):
-        self.document.removeDuplicates()
+        self._syncImageToDocument()
+        report = self.document.removeDuplicates()
+        if report is None:
+            QMessageBox.warning(self, "Remove duplicates", "Open a minecraft.jar first.")
+        else:
+            QMessageBox.information(self, "Remove duplicates", report.summary())
+
+    def on_tools_validate(self):
+        self._syncImageToDocument()
+        report = self.document.validate()
+        if report is None:
+            QMessageBox.warning(self, "Validate skin", "Open a minecraft.jar first.")
+        else:
+            box = QMessageBox(QMessageBox.Information, "Validate skin", report.summary(), QMessageBox.Ok, self)
+            if not report.isValid():
+                box.setDetailedText(report.details())
+            box.exec_()
+
+    def on_tools_reduce_palettes(self, value):
+        self.document.reducePalettes = value
+
+    def on_tools_png_compression(self, action):
+        self.document.pngCompression = action.data()
+
+    def on_tools_performance(self):
+        # Built on first use, it is not needed for the editor to start
+        if self._performanceDialog is None:
+            self._performanceDialog = PerformanceDialog(self)
+        self._performanceDialog.show()
+        self._performanceDialog.raise_()
 
     def closeEvent(self, event):
         if not self._maybeSave():
                 event.ignore()
 
+    def paintEvent(self, event):
+        QMainWindow.paintEvent(self, event)
+        if "painted" not in startupTimes:
+            startupTimes["painted"] = time.perf_counter()
+        if self._initialOpen is not None:
+            jars, skin, timing = self._initialOpen
+            self._initialOpen = None
+            QTimer.singleShot(0, lambda: self.openInitial(jars, skin, timing))
+
+    def openAfterPaint(self, jars, skin, timing):
+        self._initialOpen = (jars, skin, timing)
+        self.update()
+
+    def openInitial(self, jars, skin, timing):
+        # Runs once the window has painted, so indexing never delays the first paint
+        if jars:
+            self.document.setMinecraftJars(jars)
+        if skin:
+            self._runWithProgress("Loading skin...", lambda: self.document.load(skin))
+        startupTimes["interactive"] = time.perf_counter()
+        if timing:
+            print(startupReport())
+            self.statusBar().showMessage(startupReport(), 5000)
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
 
+    parser = argparse.ArgumentParser(prog="sgtskinner", description="Sgt.Skinner - a minecraft skin editor")
+    parser.add_argument("--jar", action="append", help="minecraft.jar to open, repeat to add mod jars and asset folders overriding it")
+    parser.add_argument("--timing", action="store_true", help="report start up times, also enabled by SGTSKINNER_TIMING=1")
+    parser.add_argument("skin", nargs="?", help="skin folder to open")
+    args, unknown = parser.parse_known_args(app.arguments()[1:])
+    timing = args.timing or os.environ.get("SGTSKINNER_TIMING", "") == "1"
+
     window = MainWindow()
     window.show()
+    startupTimes["window"] = time.perf_counter()
+    window.openAfterPaint(args.jar, args.skin, timing)
 
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
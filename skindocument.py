@@ -0,0 +1,1608 @@
+#
+#    Sgt.Skinner - A Minecraft skin editor
+#    Copyright (C) 2020 Johan Thelin
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pathlib
+import zipfile
+import collections
+import hashlib
+import json
+import shutil
+import time
+import threading
+import concurrent.futures
+
+from PySide2.QtGui import QImage, QPainter
+from PySide2.QtCore import Qt, Signal, QObject, QTimer \
+                         , QSize, QStandardPaths, QFileSystemWatcher \
+                         , QBuffer, QByteArray, QIODevice
+
+from skinprofile import profiler, profiled
+
+def findFilesInDir(path):
+    res = []
+    for dirName, dirList, fileList in os.walk(path):
+        dn = dirName.replace('\\', '/')
+        for f in fileList:
+            relfn = dn + '/' + f
+            if relfn.startswith(path):
+                relfn = relfn[len(path):]
+            res.append(relfn)
+    return res
+
+def isIgnoredFile(fn):
+    # Hidden files and folders, like .DS_Store, and the temp files of writes in progress are not part of a pack
+    return fn.endswith(".tmp") or any(part.startswith('.') for part in fn.split('/'))
+
+def readAssetImage(assets, filename):
+    # Split in two, so the profiler can tell inflating from png decoding
+    with profiler.timed("zip.read"):
+        data = assets.read(filename)
+    with profiler.timed("png.decode"):
+        return QImage.fromData(data)
+
+def pngSize(f):
+    # Width and height from the IHDR chunk, which always comes first, or None if f is no png
+    header = f.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        return None
+    return (int.from_bytes(header[16:20], 'big'), int.from_bytes(header[20:24], 'big'))
+
+def imageBytes(image):
+    # Raw pixels normalized to ARGB32, scanlines are always 4-byte aligned so there is no padding
+    if image.format() != QImage.Format_ARGB32:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+    return bytes(image.constBits())
+
+def imageHash(image):
+    # Hash of the pixels normalized to ARGB32, independent of the source format
+    h = hashlib.blake2b(digest_size=16)
+    h.update(b'%d,%d;' % (image.width(), image.height()))
+    h.update(imageBytes(image))
+    return h.hexdigest()
+
+def reducePalette(image):
+    # Textures with at most 256 colours, alpha included, are stored as exact indexed images
+    argb = image if image.format() == QImage.Format_ARGB32 else image.convertToFormat(QImage.Format_ARGB32)
+    colours = set(memoryview(bytes(argb.constBits())).cast('I'))
+    if len(colours) > 256:
+        return image
+    return argb.convertToFormat(QImage.Format_Indexed8, sorted(colours))
+
+def savePng(image, target, options):
+    # options are (zlib level 0-9 or -1 for Qt's default, palette reduction on/off)
+    compression, palette = options
+    if palette:
+        with profiler.timed("png.reducePalette"):
+            image = reducePalette(image)
+    # Qt maps quality to the zlib level as (100-quality)*9/91
+    quality = -1
+    if compression >= 0:
+        quality = 100 - (min(compression, 9) * 91 + 8) // 9
+    with profiler.timed("png.encode"):
+        return image.save(target, "PNG", quality)
+
+def writeImage(image, sourcePath, destination, options):
+    # Runs on the worker pool, decodes from sourcePath when no image is given
+    # Returns the new size and the size of the file it replaced, or -1 for a failure
+    if image is None:
+        with profiler.timed("png.decode"):
+            image = QImage(sourcePath)
+    pathlib.Path(destination).parent.mkdir(parents=True, exist_ok=True)
+    previous = os.path.getsize(destination) if os.path.isfile(destination) else -1
+    # Write next to the destination and rename, so a failed save never leaves a truncated png
+    temp = destination + ".tmp"
+    try:
+        if savePng(image, temp, options):
+            os.replace(temp, destination)
+            return (os.path.getsize(destination), previous)
+        else:
+            return (-1, previous)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+def copySource(openSource, destination):
+    # Runs on the worker pool, streams bytes that already hold the image to the destination
+    temp = destination + ".tmp"
+    try:
+        pathlib.Path(destination).parent.mkdir(parents=True, exist_ok=True)
+        previous = os.path.getsize(destination) if os.path.isfile(destination) else -1
+        with openSource() as src, open(temp, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024*1024)
+        os.replace(temp, destination)
+        return (os.path.getsize(destination), previous)
+    except OSError:
+        return (-1, -1)
+    finally:
+        if os.path.isfile(temp):
+            os.remove(temp)
+
+def encodeImage(image, sourcePath, options):
+    # Runs on the worker pool, returns the png file contents
+    if image is None:
+        with profiler.timed("png.decode"):
+            image = QImage(sourcePath)
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.WriteOnly)
+    savePng(image, buf, options)
+    buf.close()
+    return bytes(data)
+
+def fileHash(fn):
+    # Hash of the file bytes, equal bytes always decode to equal pixels
+    h = hashlib.blake2b(digest_size=16)
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def fileCacheKey(fn):
+    st = os.stat(fn)
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return "%d-%d-%s" % (st.st_size, int(st.st_mtime), h.hexdigest())
+
+def cacheDir():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), "sgtskinner")
+
+class AssetIndex:
+    # Jars and asset folders mounted in order, later mounts override the files of earlier ones
+    MAX_OPEN_ARCHIVES = 8
+
+    # Central directories read so far, path -> (size, mtime, filename -> ZipInfo), so remounting is free
+    _listings = {}
+    # Cache keys of jars, path -> (size, mtime, key), so a jar is only hashed again once it changes
+    _keys = {}
+
+    def __init__(self, maxOpenArchives = MAX_OPEN_ARCHIVES):
+        self._maxOpenArchives = maxOpenArchives
+        # Guards the open archives, entries are read from the worker pool
+        self._lock = threading.Lock()
+        self._archives = collections.OrderedDict()
+        self.clear()
+
+    def clear(self):
+        self._closeArchives()
+        self._mounts = []
+        # filename -> (mount, ZipInfo or path on disk) of the mount providing it
+        self._entries = {}
+        self._names = None
+
+    def _closeArchives(self):
+        with self._lock:
+            for zf in self._archives.values():
+                zf.close()
+            self._archives.clear()
+
+    def mount(self, path):
+        if os.path.isdir(path):
+            root = path.replace('\\', '/').rstrip('/')
+            listing = {fn: root + '/' + fn for fn in findFilesInDir(root + '/')}
+        else:
+            listing = AssetIndex._jarListing(path)
+        mount = len(self._mounts)
+        self._mounts.append(path)
+        for fn, entry in listing.items():
+            self._entries[fn] = (mount, entry)
+        self._names = None
+        return len(listing)
+
+    def _jarListing(path):
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        cached = AssetIndex._listings.get(key)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        with zipfile.ZipFile(path, 'r') as zf:
+            listing = {info.filename: info for info in zf.infolist() if not info.is_dir()}
+        AssetIndex._listings[key] = (st.st_size, st.st_mtime_ns, listing)
+        return listing
+
+    def isEmpty(self):
+        return len(self._mounts) == 0
+
+    def mounts(self):
+        return list(self._mounts)
+
+    def contains(self, filename):
+        return filename in self._entries
+
+    def names(self):
+        # Sorted, and only rebuilt when the mounts change
+        if self._names is None:
+            self._names = sorted(self._entries)
+        return self._names
+
+    def mountOf(self, filename):
+        return self._mounts[self._entries[filename][0]]
+
+    def info(self, filename):
+        # ZipInfo of a jar entry, None for files in folders
+        entry = self._entries[filename][1]
+        return None if isinstance(entry, str) else entry
+
+    def stamp(self, filename):
+        # Changes whenever the content does, the CRC for jar entries and size and mtime for files
+        entry = self._entries[filename][1]
+        if isinstance(entry, str):
+            st = os.stat(entry)
+            return "%d-%d" % (st.st_size, st.st_mtime_ns)
+        return entry.CRC
+
+    def sourceKey(path):
+        # Names the on-disk cache of a jar or folder, folders are checked file by file through stamp()
+        if os.path.isdir(path):
+            return "dir-" + hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        cached = AssetIndex._keys.get(key)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        res = fileCacheKey(path)
+        AssetIndex._keys[key] = (st.st_size, st.st_mtime_ns, res)
+        return res
+
+    def mountIndex(self, filename):
+        return self._entries[filename][0]
+
+    def open(self, filename):
+        mount, entry = self._entries[filename]
+        if isinstance(entry, str):
+            return open(entry, 'rb')
+        # Opened under the lock, an open entry keeps its archive readable when it is evicted
+        with self._lock:
+            return self._archive(mount).open(entry)
+
+    def read(self, filename):
+        with self.open(filename) as f:
+            return f.read()
+
+    def _archive(self, mount):
+        zf = self._archives.get(mount)
+        if zf is None:
+            profiler.count("assets.archiveOpened")
+            zf = zipfile.ZipFile(self._mounts[mount], 'r')
+            self._archives[mount] = zf
+            while len(self._archives) > self._maxOpenArchives:
+                self._archives.popitem(last=False)[1].close()
+        else:
+            self._archives.move_to_end(mount)
+        return zf
+
+class FolderWatcher(QObject):
+    # Absolute paths of directories with added, removed or modified files, reported once writes settle
+    changed = Signal(list)
+
+    SETTLE_INTERVAL = 250
+    POLL_INTERVAL = 2000
+
+    def __init__(self, parent = None):
+        QObject.__init__(self, parent)
+        self._root = ''
+        self._watcher = None
+        self._watched = set()
+        self._pending = set()
+        self._paused = False
+        # Directory -> files with sizes and modification times, only kept while polling
+        self._snapshot = {}
+        self._settleTimer = QTimer(self)
+        self._settleTimer.setSingleShot(True)
+        self._settleTimer.setInterval(FolderWatcher.SETTLE_INTERVAL)
+        self._settleTimer.timeout.connect(self._emitChanged)
+        self._pollTimer = QTimer(self)
+        self._pollTimer.setInterval(FolderWatcher.POLL_INTERVAL)
+        self._pollTimer.timeout.connect(self._poll)
+
+    def isPolling(self):
+        return self._pollTimer.isActive()
+
+    def setPaused(self, value):
+        # Changes seen while paused are held back and reported on resume
+        self._paused = value
+        if not value and len(self._pending) > 0:
+            self._settleTimer.start()
+
+    def watch(self, root):
+        # The root for pack.png and pack.mcmeta, and everything below its assets folder
+        self.stop()
+        self._root = root
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self.on_directory_changed)
+        self._watcher.fileChanged.connect(self.on_file_changed)
+        paths = [root]
+        for dirName, dirList, fileList in os.walk(root + "/assets"):
+            dn = dirName.replace('\\', '/')
+            paths.append(dn)
+            paths.extend([dn + '/' + f for f in fileList if f.endswith(".png")])
+        self._addPaths(paths)
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.deleteLater()
+            self._watcher = None
+        self._watched = set()
+        self._pending = set()
+        self._snapshot = {}
+        self._settleTimer.stop()
+        self._pollTimer.stop()
+
+    def _addPaths(self, paths):
+        paths = [p for p in paths if p not in self._watched]
+        if len(paths) == 0:
+            return
+        self._watched.update(paths)
+        failed = self._watcher.addPaths(paths)
+        if (len(failed) > 0 or os.environ.get("SGTSKINNER_POLL", "") == "1") and not self.isPolling():
+            # No notifications on this file system, or out of inotify watches, so compare modification times
+            self._snapshot = self._takeSnapshot()
+            self._pollTimer.start()
+
+    def on_directory_changed(self, path):
+        self._pending.add(path)
+        if not os.path.isdir(path):
+            self._watched.discard(path)
+        else:
+            # New sub folders are watched, and scanned in full as files may have landed before the watch
+            paths = []
+            for dirName, dirList, fileList in os.walk(self._root + "/assets" if path == self._root else path):
+                dn = dirName.replace('\\', '/')
+                if dn not in self._watched:
+                    self._pending.add(dn)
+                paths.append(dn)
+                paths.extend([dn + '/' + f for f in fileList if f.endswith(".png")])
+            self._addPaths(paths)
+        self._settleTimer.start()
+
+    def on_file_changed(self, path):
+        # Replacing a file drops its watch, so it is added again
+        self._watched.discard(path)
+        if os.path.isfile(path):
+            self._addPaths([path])
+        self._pending.add(os.path.dirname(path))
+        self._settleTimer.start()
+
+    def _emitChanged(self):
+        if self._paused:
+            return
+        dirs = sorted(self._pending)
+        self._pending = set()
+        if len(dirs) > 0:
+            self.changed.emit(dirs)
+
+    def _takeSnapshot(self):
+        res = {}
+        dirs = [self._root] + [dirName.replace('\\', '/') for dirName, dirList, fileList in os.walk(self._root + "/assets")]
+        for dn in dirs:
+            try:
+                res[dn] = frozenset((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in os.scandir(dn) if e.is_file())
+            except OSError:
+                pass
+        return res
+
+    @profiled("FolderWatcher.poll")
+    def _poll(self):
+        if self._paused:
+            return
+        snapshot = self._takeSnapshot()
+        for dn in snapshot.keys() | self._snapshot.keys():
+            if snapshot.get(dn) != self._snapshot.get(dn):
+                self._pending.add(dn)
+        self._snapshot = snapshot
+        self._emitChanged()
+
+class ImageCache:
+    def __init__(self, budget = 64*1024*1024):
+        self._budget = budget
+        self._used = 0
+        self._images = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def budget(self):
+        return self._budget
+
+    def setBudget(self, budget):
+        self._budget = budget
+        self._evict()
+
+    def usedBytes(self):
+        return self._used
+
+    def get(self, key):
+        if key in self._images:
+            self._images.move_to_end(key)
+            self.hits += 1
+            return self._images[key]
+        else:
+            self.misses += 1
+            return None
+
+    def put(self, key, image):
+        self.remove(key)
+        self._images[key] = image
+        self._used += image.sizeInBytes()
+        self._evict()
+
+    def remove(self, key):
+        if key in self._images:
+            self._used -= self._images.pop(key).sizeInBytes()
+
+    def clear(self):
+        self._images.clear()
+        self._used = 0
+
+    def stats(self):
+        return { "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._images), "bytes": self._used }
+
+    def _evict(self):
+        # Always keep the most recently used image, even if it is over budget
+        while self._used > self._budget and len(self._images) > 1:
+            key, image = self._images.popitem(last=False)
+            self._used -= image.sizeInBytes()
+            self.evictions += 1
+
+class ThumbnailAtlas:
+    SIZE = 32
+    # Cells per row and column of each atlas page
+    CELLS = 32
+
+    def __init__(self):
+        self._pages = []
+        self._slots = {}
+        self._free = []
+
+    def hasThumbnail(self, key):
+        return key in self._slots
+
+    def thumbnail(self, key):
+        if key in self._slots:
+            index, w, h = self._slots[key]
+            page, x, y = self._cellPosition(index)
+            return self._pages[page].copy(x, y, w, h)
+        else:
+            return None
+
+    def setThumbnail(self, key, image):
+        if key in self._slots:
+            index = self._slots[key][0]
+        elif len(self._free) > 0:
+            index = self._free.pop()
+        else:
+            index = len(self._slots)
+            if index >= len(self._pages) * ThumbnailAtlas.CELLS * ThumbnailAtlas.CELLS:
+                side = ThumbnailAtlas.SIZE * ThumbnailAtlas.CELLS
+                page = QImage(side, side, QImage.Format_ARGB32_Premultiplied)
+                page.fill(Qt.transparent)
+                self._pages.append(page)
+
+        scaled = image.scaled(ThumbnailAtlas.SIZE, ThumbnailAtlas.SIZE, Qt.KeepAspectRatio)
+        page, x, y = self._cellPosition(index)
+        p = QPainter(self._pages[page])
+        p.setCompositionMode(QPainter.CompositionMode_Source)
+        p.fillRect(x, y, ThumbnailAtlas.SIZE, ThumbnailAtlas.SIZE, Qt.transparent)
+        p.drawImage(x, y, scaled)
+        p.end()
+        self._slots[key] = (index, scaled.width(), scaled.height())
+
+    def removeThumbnail(self, key):
+        if key in self._slots:
+            self._free.append(self._slots.pop(key)[0])
+
+    def clear(self):
+        self._pages = []
+        self._slots = {}
+        self._free = []
+
+    def save(self, path):
+        for i in range(len(self._pages)):
+            self._pages[i].save(path + "/thumbs-%d.png" % i)
+        return { "pages": len(self._pages), "slots": self._slots, "free": self._free }
+
+    def load(self, path, state):
+        pages = []
+        for i in range(state["pages"]):
+            page = QImage(path + "/thumbs-%d.png" % i)
+            if page.isNull():
+                return False
+            pages.append(page.convertToFormat(QImage.Format_ARGB32_Premultiplied))
+        self._pages = pages
+        self._slots = {key: tuple(slot) for key, slot in state["slots"].items()}
+        self._free = list(state["free"])
+        return True
+
+    def _cellPosition(self, index):
+        perPage = ThumbnailAtlas.CELLS * ThumbnailAtlas.CELLS
+        page = index // perPage
+        cell = index % perPage
+        return (page, (cell % ThumbnailAtlas.CELLS) * ThumbnailAtlas.SIZE, (cell // ThumbnailAtlas.CELLS) * ThumbnailAtlas.SIZE)
+
+class ValidationReport:
+    def __init__(self):
+        # Lists of (filename, (width, height) in the skin, (width, height) in the jar)
+        self.sizeMismatches = []
+        self.missingOriginals = []
+        self.orphans = []
+        self.invalid = []
+
+    def isValid(self):
+        return len(self.sizeMismatches) == 0 and len(self.missingOriginals) == 0 and len(self.orphans) == 0 and len(self.invalid) == 0
+
+    def summary(self):
+        return "%d size mismatches, %d textures not in the jar, %d orphaned files, %d unreadable pngs." % (len(self.sizeMismatches), len(self.missingOriginals), len(self.orphans), len(self.invalid))
+
+    def details(self):
+        res = []
+        for fn, size, originalSize in self.sizeMismatches:
+            res.append("size: %s is %dx%d, the original is %dx%d" % (fn, size[0], size[1], originalSize[0], originalSize[1]))
+        for fn in self.missingOriginals:
+            res.append("missing: " + fn)
+        for fn in self.orphans:
+            res.append("orphan: " + fn)
+        for fn in self.invalid:
+            res.append("invalid: " + fn)
+        return "\n".join(res)
+
+class DuplicateReport:
+    def __init__(self):
+        self.duplicates = []
+        self.changed = []
+        self.sizeMismatches = []
+        self.missing = []
+
+    def summary(self):
+        return "%d duplicates removed, %d size mismatches, %d not in the jar." % (len(self.duplicates), len(self.sizeMismatches), len(self.missing))
+
+class SaveReport:
+    def __init__(self):
+        self.written = []
+        self.removed = []
+        self.failed = []
+        self.bytesWritten = 0
+        self.cancelled = False
+        # Re-encoded files, with their new size and the size of the file they replaced
+        self.encoded = {}
+
+    def bytesSaved(self):
+        return sum(previous - size for size, previous in self.encoded.values() if previous >= 0)
+
+    def summary(self):
+        res = "%d files (%d bytes) written, %d removed." % (len(self.written), self.bytesWritten, len(self.removed))
+        saved = self.bytesSaved()
+        if saved > 0:
+            res += " Re-encoded files are %d bytes smaller than before." % saved
+        elif saved < 0:
+            res += " Re-encoded files are %d bytes larger than before." % -saved
+        if len(self.failed) > 0:
+            res += " %d failed." % len(self.failed)
+        if self.cancelled:
+            res += " Cancelled."
+        return res
+
+class Document(QObject):
+    imageChanged = Signal(str)
+    allChanged = Signal()
+    thumbnailsReady = Signal(list)
+    # Files reloaded from disk after they were changed outside the editor
+    filesReloaded = Signal(list)
+    # Operation name, items done, items in total
+    progress = Signal(str, int, int)
+
+    # Thumbnails built per timer tick while idle
+    THUMBNAIL_BATCH = 64
+
+    # Pixel hashes of png files by the hash of their bytes, shared by all documents, so files
+    # seen before never need decoding to be hashed again
+    _pixelHashes = {}
+
+    def isSkin(path):
+        # TODO
+        # fileexists("pack.mcmeta")
+        # fileexists("pack.png")
+        # direxists("assets")
+        return True
+
+    def isSkinOrEmpty(path):
+        # TODO
+        return True
+
+    def __init__(self, background = True):
+        QObject.__init__(self)
+
+        # Without background work thumbnails are only built by calling buildThumbnails(), as in batch mode
+        self._background = background
+        self.jarFilenames = []
+        self._path = ''
+        self._assets = AssetIndex()
+        # Sorted png filenames of the mounted jars and folders
+        self._originals = []
+        self._originalSet = set()
+        self._originalMeta = {}
+        # Mounts with original metadata computed that their on-disk cache does not have yet
+        self._dirtyMounts = set()
+        self._originalCache = ImageCache()
+        self._mountKeys = []
+        # Files found on disk at load, decoded lazily into a bounded cache, and images set since
+        self._files = {}
+        self._otherFiles = {}
+        self._decoded = ImageCache()
+        self._images = {}
+        # Where the bytes of a set image came from, and its pixel hash at the time
+        self._sources = {}
+        self._sourceHashes = {}
+        # Files modified since the last save, and files to delete from the skin folder on save
+        self._dirtyFiles = set()
+        self._removedFiles = set()
+        # Size and modification time of the files in the skin folder as last seen, to spot changes made elsewhere
+        self._diskStamps = {}
+        self._watcher = None
+        # Decode and thumbnail every skin texture in the background, otherwise only those asked for
+        self.prefetch = True
+        # Hashes of the file bytes as loaded, and the thumbnails asked for while not prefetching
+        self._fileHashes = {}
+        self._requestedThumbnails = set()
+        # Png output, zlib level 0-9 (-1 is Qt's default) and indexed output for textures of few colours
+        self.pngCompression = -1
+        self.reducePalettes = True
+
+        # Shared by the load, save and compare pipelines, QImage decode and encode are reentrant
+        self._pool = concurrent.futures.ThreadPoolExecutor()
+        self._cancelled = False
+        # Background work on hold while a long operation runs
+        self._paused = 0
+
+        # Content hashes of the skin images, the hashes seen at load, and hash to filenames lookups
+        self._imageHashes = {}
+        self._loadedHashes = {}
+        self._hashIndex = {}
+        self._originalHashIndex = {}
+
+        self._originalThumbnails = ThumbnailAtlas()
+        self._thumbnails = ThumbnailAtlas()
+        self._pendingThumbnails = []
+        self._thumbnailTimer = QTimer(self)
+        self._thumbnailTimer.setInterval(0)
+        self._thumbnailTimer.timeout.connect(self.buildThumbnails)
+
+    def clear(self):
+        self._files = {}
+        self._otherFiles = {}
+        self._diskStamps = {}
+        self._fileHashes = {}
+        if self._watcher is not None:
+            self._watcher.stop()
+        self._decoded.clear()
+        self._images = {}
+        self._sources = {}
+        self._sourceHashes = {}
+        self._dirtyFiles = set()
+        self._removedFiles = set()
+        self._resetImageHashes()
+        self._scheduleThumbnails("skin")
+        self.allChanged.emit()
+
+    def isDirty(self):
+        if len(self._dirtyFiles) > 0 or len(self._removedFiles) > 0:
+            return True
+        else:
+            return False
+
+    def dirtyFilenames(self):
+        return sorted(self._dirtyFiles)
+
+    def hasPath(self):
+        if self._path == '':
+            return False
+        else:
+            return True
+
+    @profiled("Document.load")
+    def load(self, path):
+        self._pauseBackground()
+        try:
+            return self._load(path)
+        finally:
+            self._resumeBackground()
+
+    def _load(self, path):
+        # Returns False when cancelled, the document is then left as it was
+        self._cancelled = False
+        # Only record what is there, images are decoded on first use
+        filesInAssets = [fn for fn in findFilesInDir(path + "/assets/") if not isIgnoredFile(fn)]
+        fns = ["assets/" + fn for fn in filesInAssets if fn.endswith(".png")]
+        if len(fns) > 0 and os.path.isfile(path + "/pack.png"):
+            fns.append("pack.png")
+        # Meta-data and models are not edited, but are carried along on export
+        otherFiles = {"assets/" + fn: path + "/assets/" + fn for fn in filesInAssets if not fn.endswith(".png")}
+        if os.path.isfile(path + "/pack.mcmeta"):
+            otherFiles["pack.mcmeta"] = path + "/pack.mcmeta"
+        # Listing and hashing report one range, twice the number of files
+        files = {}
+        diskStamps = {}
+        for i in range(len(fns)):
+            if self._cancelled:
+                return False
+            fn = fns[i]
+            st = os.stat(path + '/' + fn)
+            files[fn] = (path + '/' + fn, st.st_size, st.st_mtime)
+            diskStamps[fn] = (st.st_size, st.st_mtime_ns)
+            if i % 256 == 0:
+                self.progress.emit("load", i, 2 * len(fns))
+
+        # Reading is far cheaper than decoding, and pngs hashed before get their pixel hash for free
+        futures = [self._pool.submit(fileHash, files[fn][0]) for fn in fns]
+        fileHashes = {}
+        for i, (fn, future) in enumerate(zip(fns, futures)):
+            if self._cancelled:
+                for f in futures:
+                    f.cancel()
+                return False
+            fileHashes[fn] = future.result()
+            if i % 256 == 0:
+                self.progress.emit("load", len(fns) + i, 2 * len(fns))
+        self.progress.emit("load", 2 * len(fns), 2 * len(fns))
+
+        self._path = path
+        self._images = {}
+        self._sources = {}
+        self._sourceHashes = {}
+        self._files = files
+        self._diskStamps = diskStamps
+        self._decoded.clear()
+        self._otherFiles = otherFiles
+        self._dirtyFiles = set()
+        self._removedFiles = set()
+        self._resetImageHashes()
+        self._fileHashes = fileHashes
+        for fn in fns:
+            if fileHashes[fn] in Document._pixelHashes:
+                self._recordLoadedHash(fn, Document._pixelHashes[fileHashes[fn]])
+        self._scheduleThumbnails("skin")
+        if self._watcher is not None:
+            self._watcher.watch(path)
+        self.allChanged.emit()
+        return True
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _pauseBackground(self):
+        # Progress dialogs run the event loop mid-operation, thumbnails and reloads must not interleave
+        self._paused += 1
+        self._thumbnailTimer.stop()
+        if self._watcher is not None:
+            self._watcher.setPaused(True)
+
+    def _resumeBackground(self):
+        self._paused -= 1
+        if self._paused == 0:
+            self._startThumbnails()
+            if self._watcher is not None:
+                self._watcher.setPaused(False)
+
+    def _startThumbnails(self):
+        if len(self._pendingThumbnails) > 0 and self._background and self._paused == 0:
+            self._thumbnailTimer.start()
+
+    @profiled("Document.save")
+    def save(self):
+        self._pauseBackground()
+        try:
+            return self._save()
+        finally:
+            self._resumeBackground()
+
+    def _save(self):
+        report = SaveReport()
+        self._cancelled = False
+
+        # Decoding of images not yet in memory, encoding and writing all happen on the pool
+        futures = {}
+        for fn in sorted(self._dirtyFiles):
+            destination = self._path + '/' + fn
+            source = self._passThroughSource(fn)
+            if source is not None and source[0] == "file" and os.path.abspath(source[1]) == os.path.abspath(destination):
+                # The pixels are back to what is on disk already
+                self._dirtyFiles.discard(fn)
+                continue
+            elif source is not None:
+                future = self._pool.submit(copySource, self._sourceOpener(source), destination)
+            elif fn in self._images:
+                future = self._pool.submit(writeImage, self._images[fn], None, destination, self._pngOptions())
+            else:
+                future = self._pool.submit(writeImage, self._decoded.get(fn), self._files[fn][0], destination, self._pngOptions())
+            futures[future] = (fn, self._imageHashes.get(fn), source is None)
+
+        done = 0
+        for future in concurrent.futures.as_completed(futures):
+            done += 1
+            if future.cancelled():
+                continue
+            fn, h, encoded = futures[future]
+            try:
+                size, previous = future.result()
+            except OSError as e:
+                print("FAILURE: unable to write " + fn + ": " + str(e))
+                size, previous = (-1, -1)
+            if size >= 0:
+                report.written.append(fn)
+                report.bytesWritten += size
+                if encoded:
+                    report.encoded[fn] = (size, previous)
+                self._dirtyFiles.discard(fn)
+                self._recordDiskStamp(fn)
+                # The bytes on disk are no longer the ones loaded, and after saveAs they are in the new folder
+                self._fileHashes.pop(fn, None)
+                self._rerootFile(fn)
+                if fn in self._images:
+                    self._sources[fn] = ("file", self._path + '/' + fn)
+                    self._sourceHashes[fn] = h
+            else:
+                report.failed.append(fn)
+            self.progress.emit("save", done, len(futures))
+            if self._cancelled and not report.cancelled:
+                # Files already being written finish, the rest stay dirty
+                report.cancelled = True
+                for f in futures:
+                    f.cancel()
+        report.written.sort()
+
+        for fn in sorted(self._removedFiles):
+            try:
+                os.remove(self._path + '/' + fn)
+                self._diskStamps.pop(fn, None)
+                report.removed.append(fn)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                report.failed.append(fn)
+                continue
+            self._removedFiles.discard(fn)
+        # Saving never changes which files there are, only the rows of the files touched are updated
+        for fn in report.written + report.removed:
+            self.imageChanged.emit(fn)
+        return report
+
+    def _compareWithOriginal(self, fn, ni, path, h):
+        if ni is None:
+            ni = QImage(path)
+        if h is None:
+            h = imageHash(ni)
+        res, original = self._compareImages(fn, ni, h)
+        return (res, h, original)
+
+    def _compareImages(self, fn, ni, h):
+        # Returns the result, and the decoded original with its hash and thumbnail when it had to be read
+        size = self.originalSize(fn)
+        if size is not None and (size.width() != ni.width() or size.height() != ni.height()):
+            return ("size", None)
+
+        # A known original hash saves decoding the original at all
+        originalHash = self.originalHash(fn)
+        if originalHash is not None:
+            if h == originalHash:
+                return ("dupe", None)
+            else:
+                return ("differs", None)
+
+        if size is None:
+            # The header is enough to rule out a duplicate of another size
+            originalSize = self.originalHeaderSize(fn)
+            if originalSize is not None and originalSize != (ni.width(), ni.height()):
+                return ("size", None)
+
+        oi, oh, thumb = self._decodeThumbnail("orig", fn, None, None)
+        if oi.width() != ni.width() or oi.height() != ni.height():
+            res = "size"
+        elif oh == h:
+            res = "dupe"
+        else:
+            res = "differs"
+        return (res, (oi, oh, thumb))
+
+    def originalHeaderSize(self, filename):
+        # Only inflates the first block of the entry
+        if filename in self._originalMeta:
+            return (self._originalMeta[filename][0], self._originalMeta[filename][1])
+        with self._assets.open(filename) as f:
+            return pngSize(f)
+
+    def _imageHeaderSize(self, filename):
+        if filename in self._images:
+            return (self._images[filename].width(), self._images[filename].height())
+        try:
+            with open(self._files[filename][0], 'rb') as f:
+                return pngSize(f)
+        except OSError:
+            return None
+
+    @profiled("Document.validate")
+    def validate(self):
+        # Checks sizes from the png headers alone, nothing is decoded
+        if self._assets.isEmpty():
+            return None
+
+        report = ValidationReport()
+        candidates = []
+        for fn in sorted(self.imageFilenames()):
+            if fn == "pack.png":
+                continue
+            elif self.hasOriginalImage(fn):
+                candidates.append(fn)
+            else:
+                report.missingOriginals.append(fn)
+
+        sizes = self._pool.map(lambda fn: (self._imageHeaderSize(fn), self.originalHeaderSize(fn)), candidates)
+        for fn, (size, originalSize) in zip(candidates, sizes):
+            if size is None:
+                report.invalid.append(fn)
+            elif originalSize is not None and size != originalSize:
+                report.sizeMismatches.append((fn, size, originalSize))
+
+        # Animation meta-data needs its texture in the skin, anything else has to override a jar file
+        for fn in sorted(self._otherFiles):
+            if fn == "pack.mcmeta":
+                continue
+            elif fn.endswith(".png.mcmeta"):
+                if not self.hasImage(fn[:-len(".mcmeta")]):
+                    report.orphans.append(fn)
+            elif not self._assets.contains(fn):
+                report.orphans.append(fn)
+        return report
+
+    @profiled("Document.compareWithOriginals")
+    def compareWithOriginals(self):
+        if self._assets.isEmpty():
+            return None
+
+        report = DuplicateReport()
+        candidates = []
+        for fn in self.imageFilenames():
+            if self.hasOriginalImage(fn):
+                # Images not yet decoded are read by the workers, bypassing the shared cache
+                if fn in self._images:
+                    candidates.append((fn, self._images[fn], None, self._imageHashes.get(fn)))
+                else:
+                    candidates.append((fn, self._decoded.get(fn), self._files[fn][0], self._imageHashes.get(fn)))
+            else:
+                report.missing.append(fn)
+
+        # Zip reads are serialized on the shared file handle, decoding and comparing are not
+        results = self._pool.map(lambda c: self._compareWithOriginal(*c), candidates)
+        for c, (res, h, original) in zip(candidates, results):
+            fn = c[0]
+            if fn not in self._images:
+                self._recordLoadedHash(fn, h)
+            # Kept, so the next pack compared against the same jars needs no decoding of it
+            if original is not None:
+                self._setOriginalMeta(fn, *original)
+            if res == "dupe":
+                report.duplicates.append(fn)
+            elif res == "size":
+                report.sizeMismatches.append(fn)
+            else:
+                report.changed.append(fn)
+        self._flushJarCache()
+        return report
+
+    def removeDuplicates(self):
+        # TODO is this to be a part of saving, or something optional?
+        report = self.compareWithOriginals()
+        if report is None:
+            return None
+
+        for fn in report.duplicates:
+            self.clearImage(fn)
+            self.imageChanged.emit(fn)
+        return report
+
+    def _pngOptions(self):
+        return (self.pngCompression, self.reducePalettes)
+
+    def _passThroughSource(self, filename):
+        # A ("file", path) or ("jar", entry) holding exactly the current pixels, or None if it has to be encoded
+        if filename in self._images:
+            h = self._imageHashes.get(filename)
+            if filename in self._sources and h == self._sourceHashes.get(filename):
+                return self._sources[filename]
+            elif filename in self._fileHashes and h == self._loadedHashes.get(filename):
+                return ("file", self._files[filename][0])
+            else:
+                return None
+        elif filename in self._files:
+            return ("file", self._files[filename][0])
+        else:
+            return None
+
+    def _sourceOpener(self, source):
+        if source[0] == "jar":
+            assets = self._assets
+            return lambda: assets.open(source[1])
+        else:
+            return lambda: open(source[1], 'rb')
+
+    @profiled("Document.exportZip")
+    def exportZip(self, filename, compressPng = False):
+        temp = filename + ".tmp"
+        self._pauseBackground()
+        try:
+            return self._exportZip(filename, temp, compressPng)
+        finally:
+            self._resumeBackground()
+            # Left behind by a cancelled or failed export
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def _exportZip(self, filename, temp, compressPng):
+        # Pngs are already deflated, so by default they are stored as they are
+        report = SaveReport()
+        self._cancelled = False
+        pngCompression = zipfile.ZIP_DEFLATED if compressPng else zipfile.ZIP_STORED
+        fns = sorted(self.imageFilenames())
+
+        # Encoding runs ahead on the pool, but only a few images are held at any time
+        window = collections.deque()
+        ahead = 2 * (os.cpu_count() or 1)
+        with zipfile.ZipFile(temp, 'w') as zf:
+            for fn, source in sorted(self._otherFiles.items()):
+                zf.write(source, fn, zipfile.ZIP_DEFLATED)
+
+            i = 0
+            while (i < len(fns) or len(window) > 0) and not self._cancelled:
+                while i < len(fns) and len(window) < ahead:
+                    fn = fns[i]
+                    source = self._passThroughSource(fn)
+                    if source is not None:
+                        window.append((fn, source, None))
+                    elif fn in self._images:
+                        window.append((fn, None, self._pool.submit(encodeImage, self._images[fn], None, self._pngOptions())))
+                    else:
+                        window.append((fn, None, self._pool.submit(encodeImage, self._decoded.get(fn), self._files[fn][0], self._pngOptions())))
+                    i += 1
+
+                fn, source, future = window.popleft()
+                info = zipfile.ZipInfo(fn, time.localtime()[:6])
+                info.compress_type = pngCompression
+                if source is not None:
+                    # Unchanged files are streamed through without decoding
+                    with self._sourceOpener(source)() as src, zf.open(info, 'w') as dst:
+                        shutil.copyfileobj(src, dst, 1024*1024)
+                else:
+                    data = future.result()
+                    zf.writestr(info, data)
+                    previous = self._files[fn][1] if fn in self._files else -1
+                    report.encoded[fn] = (len(data), previous)
+                report.written.append(fn)
+                self.progress.emit("export", len(report.written), len(fns))
+
+        if self._cancelled:
+            for fn, source, future in window:
+                if future is not None:
+                    future.cancel()
+            report.cancelled = True
+        else:
+            os.replace(temp, filename)
+            report.bytesWritten = os.path.getsize(filename)
+        return report
+
+    def saveAs(self, path):
+        self._pauseBackground()
+        try:
+            return self._saveAs(path)
+        finally:
+            self._resumeBackground()
+
+    def _saveAs(self, path):
+        self._path = path
+        # Everything needs to go to a new folder, but nothing is to be removed from it
+        self._dirtyFiles = set(self.imageFilenames())
+        self._removedFiles = set()
+        self._diskStamps = {}
+        report = self.save()
+
+        # pack.mcmeta and the other assets go along, or the copy is not a loadable pack
+        if not report.cancelled:
+            futures = {}
+            for fn, source in self._otherFiles.items():
+                destination = path + '/' + fn
+                if os.path.abspath(source) != os.path.abspath(destination):
+                    futures[fn] = self._pool.submit(copySource, self._sourceOpener(("file", source)), destination)
+            for fn in sorted(futures):
+                size, previous = futures[fn].result()
+                if size >= 0:
+                    report.written.append(fn)
+                    report.bytesWritten += size
+                    self._otherFiles[fn] = path + '/' + fn
+                else:
+                    report.failed.append(fn)
+            report.written.sort()
+
+        if self._watcher is not None:
+            self._watcher.watch(path)
+        return report
+
+    def clearImage(self, filename):
+        if self.hasImage(filename):
+            self._forgetImage(filename)
+            self._dirtyFiles.discard(filename)
+            self._removedFiles.add(filename)
+
+    def _forgetImage(self, filename):
+        self._images.pop(filename, None)
+        self._sources.pop(filename, None)
+        self._sourceHashes.pop(filename, None)
+        self._files.pop(filename, None)
+        self._decoded.remove(filename)
+        self._removeImageHash(filename)
+        self._thumbnails.removeThumbnail(filename)
+
+    def _rerootFile(self, filename):
+        # Lazy decodes and pass-through read the file just written, not the one it was loaded from
+        try:
+            st = os.stat(self._path + '/' + filename)
+            self._files[filename] = (self._path + '/' + filename, st.st_size, st.st_mtime)
+        except OSError:
+            pass
+
+    def _recordDiskStamp(self, filename):
+        try:
+            st = os.stat(self._path + '/' + filename)
+            self._diskStamps[filename] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            self._diskStamps.pop(filename, None)
+
+    def isWatching(self):
+        return self._watcher is not None
+
+    def setWatching(self, value):
+        # Picks up changes made to the skin folder by other programs, needs a running event loop
+        if value and self._watcher is None:
+            self._watcher = FolderWatcher(self)
+            self._watcher.changed.connect(self.on_folder_changed)
+            if self.hasPath():
+                self._watcher.watch(self._path)
+        elif not value and self._watcher is not None:
+            self._watcher.stop()
+            self._watcher.deleteLater()
+            self._watcher = None
+
+    @profiled("Document.reloadChanged")
+    def on_folder_changed(self, dirs):
+        # Only the listed directories are scanned, and only pngs that differ from the last seen are reloaded
+        reloaded = []
+        for dn in dirs:
+            if dn == self._path:
+                rel = ''
+            elif dn == self._path + "/assets" or dn.startswith(self._path + "/assets/"):
+                rel = dn[len(self._path) + 1:]
+            else:
+                continue
+            if isIgnoredFile(rel):
+                continue
+            try:
+                found = {(rel + '/' if rel else '') + e.name: e.stat() for e in os.scandir(dn) if e.is_file() and not isIgnoredFile(e.name)}
+            except OSError:
+                found = {}
+            if rel == '':
+                found = {fn: st for fn, st in found.items() if fn in ("pack.png", "pack.mcmeta")}
+
+            for fn in [fn for fn in self._otherFiles if os.path.dirname(fn) == rel and fn not in found]:
+                del self._otherFiles[fn]
+            for fn in [fn for fn in self._diskStamps if os.path.dirname(fn) == rel and fn not in found]:
+                del self._diskStamps[fn]
+                if self._reloadImage(fn, None):
+                    reloaded.append(fn)
+            for fn, st in sorted(found.items()):
+                if not fn.endswith(".png"):
+                    self._otherFiles[fn] = self._path + '/' + fn
+                elif self._diskStamps.get(fn) != (st.st_size, st.st_mtime_ns):
+                    self._diskStamps[fn] = (st.st_size, st.st_mtime_ns)
+                    if self._reloadImage(fn, st):
+                        reloaded.append(fn)
+
+        if len(reloaded) == 0:
+            return
+        self._pendingThumbnails.extend([("skin", fn) for fn in reloaded if fn in self._files])
+        self._startThumbnails()
+        for fn in reloaded:
+            self.imageChanged.emit(fn)
+        self.filesReloaded.emit(reloaded)
+
+    def _reloadImage(self, filename, st):
+        # st is None for a removed file, unsaved edits and removals win over the file on disk
+        if filename in self._dirtyFiles or filename in self._removedFiles:
+            return False
+        self._forgetImage(filename)
+        self._loadedHashes.pop(filename, None)
+        self._fileHashes.pop(filename, None)
+        if st is not None:
+            self._files[filename] = (self._path + '/' + filename, st.st_size, st.st_mtime)
+            try:
+                self._fileHashes[filename] = fileHash(self._files[filename][0])
+            except OSError:
+                pass
+            else:
+                if self._fileHashes[filename] in Document._pixelHashes:
+                    self._recordLoadedHash(filename, Document._pixelHashes[self._fileHashes[filename]])
+        return True
+
+    def setMinecraftJar(self, fn):
+        self.setMinecraftJars([fn])
+
+    def addMinecraftJar(self, fn):
+        self.setMinecraftJars(self.jarFilenames + [fn])
+
+    @profiled("Document.setMinecraftJars")
+    def setMinecraftJars(self, fns):
+        # minecraft.jar first, then mod jars and asset folders, later ones override earlier textures
+        self.jarFilenames = list(fns)
+        self._assets.clear()
+        for fn in fns:
+            self._assets.mount(fn)
+        self._originalCache.clear()
+        # Entries of the previous jars can no longer be passed through
+        for key in [key for key in self._sources if self._sources[key][0] == "jar"]:
+            del self._sources[key]
+            del self._sourceHashes[key]
+        self._originals = [fn for fn in self._assets.names() if fn.endswith(".png")]
+        self._originalSet = set(self._originals)
+        self._originalMeta = {}
+        self._dirtyMounts = set()
+        self._originalHashIndex = {}
+        # Each jar and folder has a cache of its own, so adding or reordering them keeps what is known
+        self._mountKeys = list(self._pool.map(AssetIndex.sourceKey, fns))
+        self._originalThumbnails.clear()
+        self._scheduleThumbnails("orig", self._loadJarCache())
+        self.allChanged.emit()
+
+    def _mountCachePath(self, mount):
+        return cacheDir() + "/jars/" + self._mountKeys[mount]
+
+    def _readMountCache(self, path):
+        # (filename -> metadata, thumbnails) or None
+        try:
+            with open(path + "/index.json", 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        atlas = ThumbnailAtlas()
+        if not atlas.load(path, state["thumbnails"]):
+            return None
+        return (state["files"], atlas)
+
+    def _loadJarCache(self):
+        # Returns the originals the caches do not cover
+        for mount in range(len(self._mountKeys)):
+            cache = self._readMountCache(self._mountCachePath(mount))
+            if cache is None:
+                continue
+            meta, atlas = cache
+            for fn, m in meta.items():
+                # Only what this mount still provides, unchanged, and not overridden by a later one
+                if fn in self._originalSet and self._assets.mountIndex(fn) == mount and m[3] == self._assets.stamp(fn) and atlas.hasThumbnail(fn):
+                    self._originalMeta[fn] = tuple(m)
+                    self._originalHashIndex.setdefault(m[2], set()).add(fn)
+                    self._originalThumbnails.setThumbnail(fn, atlas.thumbnail(fn))
+        return [fn for fn in self._originals if fn not in self._originalMeta]
+
+    def _saveJarCache(self):
+        for mount in sorted(self._dirtyMounts):
+            path = self._mountCachePath(mount)
+            fns = [fn for fn in self._originalMeta if self._assets.mountIndex(fn) == mount]
+            meta = {fn: self._originalMeta[fn] for fn in fns}
+            atlas = ThumbnailAtlas()
+            for fn in fns:
+                atlas.setThumbnail(fn, self._originalThumbnails.thumbnail(fn))
+            # Files overridden by later mounts for now are kept for when they are not
+            cache = self._readMountCache(path)
+            if cache is not None:
+                for fn, m in cache[0].items():
+                    if fn not in meta and cache[1].hasThumbnail(fn):
+                        meta[fn] = m
+                        atlas.setThumbnail(fn, cache[1].thumbnail(fn))
+
+            tempPath = path + ".tmp"
+            try:
+                shutil.rmtree(tempPath, ignore_errors=True)
+                os.makedirs(tempPath)
+                state = { "source": self.jarFilenames[mount]
+                        , "files": meta
+                        , "thumbnails": atlas.save(tempPath) }
+                with open(tempPath + "/index.json", 'w') as f:
+                    json.dump(state, f)
+                shutil.rmtree(path, ignore_errors=True)
+                os.replace(tempPath, path)
+            except OSError as e:
+                print("FAILURE: unable to write cache " + path + ": " + str(e))
+        self._dirtyMounts = set()
+
+    def originalSize(self, filename):
+        if filename in self._originalMeta:
+            return QSize(self._originalMeta[filename][0], self._originalMeta[filename][1])
+        else:
+            return None
+
+    def originalHash(self, filename):
+        if filename in self._originalMeta:
+            return self._originalMeta[filename][2]
+        else:
+            return None
+
+    def originalFilenames(self):
+        # Sorted, and the same list until the jars change
+        return self._originals
+
+    def originalInfo(self, filename):
+        # ZipInfo holding file_size, compress_size and CRC, or None if missing or from a folder
+        if filename in self._originalSet:
+            return self._assets.info(filename)
+        return None
+
+    def originalSource(self, filename):
+        # The jar or folder the texture comes from, or None
+        if filename in self._originalSet:
+            return self._assets.mountOf(filename)
+        return None
+
+    def hasOriginalImage(self, filename):
+        return filename in self._originalSet
+
+    def setOriginalCacheBudget(self, budget):
+        self._originalCache.setBudget(budget)
+
+    def originalCacheStats(self):
+        return self._originalCache.stats()
+
+    def getOriginalImage(self, filename):
+        if not self._assets.isEmpty():
+            # QImage is implicitly shared, so handing out the cached instance is safe
+            res = self._originalCache.get(filename)
+            profiler.count("originalCache.hit" if res is not None else "originalCache.miss")
+            if res is None:
+                res = readAssetImage(self._assets, filename)
+                self._originalCache.put(filename, res)
+            return res
+        else:
+            # TODO what about None, and hasOriginalImage?
+            return QImage(16, 16, QImage.Format_ARGB32)
+
+    def copyOriginal(self, filename):
+        self.setImage(filename, self.getOriginalImage(filename), ("jar", filename))
+
+    def getImage(self, filename):
+        if filename in self._images:
+            return self._images[filename]
+        res = self._decoded.get(filename)
+        if res is None:
+            res = self._decodeFile(filename)
+            self._decoded.put(filename, res)
+        return res
+
+    def _decodeFile(self, filename):
+        with profiler.timed("png.decode"):
+            res = QImage(self._files[filename][0])
+        if filename not in self._loadedHashes:
+            self._recordLoadedHash(filename, imageHash(res))
+        return res
+
+    def _recordLoadedHash(self, filename, h):
+        self._loadedHashes[filename] = h
+        if filename in self._fileHashes:
+            Document._pixelHashes[self._fileHashes[filename]] = h
+        if filename not in self._images:
+            self._setImageHash(filename, h)
+
+    def hasImage(self, filename):
+        if filename in self._images or filename in self._files:
+            return True
+        else:
+            return False
+
+    def imageFilenames(self):
+        return list(self._files.keys() | self._images.keys())
+
+    def setImageCacheBudget(self, budget):
+        self._decoded.setBudget(budget)
+
+    def imageCacheStats(self):
+        return self._decoded.stats()
+
+    def setImage(self, filename, image, source = None):
+        # source is a ("file", path) or ("jar", entry) holding these exact pixels, written verbatim on save
+        self._images[filename] = image
+        self._decoded.remove(filename)
+        self._setImageHash(filename, imageHash(image))
+        if source is not None:
+            self._sources[filename] = source
+            self._sourceHashes[filename] = self._imageHashes[filename]
+        self._dirtyFiles.add(filename)
+        self._removedFiles.discard(filename)
+        self._thumbnails.setThumbnail(filename, image)
+        self.imageChanged.emit(filename)
+
+    def _resetImageHashes(self):
+        self._imageHashes = {}
+        self._loadedHashes = {}
+        self._hashIndex = {}
+
+    def _setImageHash(self, filename, h):
+        self._removeImageHash(filename)
+        self._imageHashes[filename] = h
+        self._hashIndex.setdefault(h, set()).add(filename)
+
+    def _removeImageHash(self, filename):
+        if filename in self._imageHashes:
+            h = self._imageHashes.pop(filename)
+            self._hashIndex[h].discard(filename)
+            if len(self._hashIndex[h]) == 0:
+                del self._hashIndex[h]
+
+    def _hashFile(path):
+        # Runs on the worker pool
+        with profiler.timed("png.decode"):
+            image = QImage(path)
+        return imageHash(image)
+
+    def _ensureLoadedHashes(self, filenames):
+        # Files not hashed yet are decoded on the pool, once per distinct file content
+        groups = {}
+        for fn in filenames:
+            if fn in self._files and fn not in self._loadedHashes:
+                h = self._fileHashes.get(fn)
+                if h in Document._pixelHashes:
+                    self._recordLoadedHash(fn, Document._pixelHashes[h])
+                else:
+                    groups.setdefault(fn if h is None else h, []).append(fn)
+        groups = list(groups.values())
+        for fns, h in zip(groups, self._pool.map(lambda fns: Document._hashFile(self._files[fns[0]][0]), groups)):
+            for fn in fns:
+                self._recordLoadedHash(fn, h)
+
+    def _ensureOriginalHashes(self, filenames):
+        missing = [fn for fn in filenames if fn in self._originalSet and fn not in self._originalMeta]
+        for fn, (img, h, thumb) in zip(missing, self._pool.map(lambda fn: self._decodeThumbnail("orig", fn, None, None), missing)):
+            self._setOriginalMeta(fn, img, h, thumb)
+        self._flushJarCache()
+
+    def _flushJarCache(self):
+        # The thumbnail pass writes the caches once it is through the originals, anything else right away
+        if len(self._dirtyMounts) == 0:
+            return
+        if self._background and any(kind == "orig" for kind, fn in self._pendingThumbnails):
+            return
+        self._saveJarCache()
+
+    def _setOriginalMeta(self, filename, image, h, thumb):
+        self._originalMeta[filename] = (image.width(), image.height(), h, self._assets.stamp(filename))
+        self._originalHashIndex.setdefault(h, set()).add(filename)
+        self._originalThumbnails.setThumbnail(filename, thumb)
+        self._dirtyMounts.add(self._assets.mountIndex(filename))
+
+    def imageHash(self, filename):
+        self._ensureLoadedHashes([filename])
+        return self._imageHashes.get(filename)
+
+    def isIdenticalToOriginal(self, filename):
+        self._ensureOriginalHashes([filename])
+        h = self.imageHash(filename)
+        return h is not None and h == self.originalHash(filename)
+
+    def duplicatesOf(self, filename):
+        # Every texture needs its hash for this, the missing ones are computed on the pool
+        self._ensureLoadedHashes(self.imageFilenames())
+        h = self._imageHashes.get(filename)
+        if h is None:
+            return []
+        return sorted(self._hashIndex[h] - {filename})
+
+    def originalsMatching(self, filename):
+        # Blocks until every original not hashed yet is decoded, the whole jar before the thumbnail pass is
+        # through. On the GUI thread only call it once hasPendingThumbnails() is False
+        self._ensureOriginalHashes(self._originals)
+        h = self.imageHash(filename)
+        if h is None:
+            return []
+        return sorted(self._originalHashIndex.get(h, set()))
+
+    def isChangedSinceLoad(self, filename):
+        # Files never decoded can not have changed
+        if filename in self._files and filename not in self._images:
+            return False
+        self._ensureLoadedHashes([filename])
+        return self._imageHashes.get(filename) != self._loadedHashes.get(filename)
+
+    def changedSinceLoad(self):
+        self._ensureLoadedHashes(list(self._images))
+        return sorted(fn for fn in set(self._images) | set(self._loadedHashes) if self.isChangedSinceLoad(fn))
+
+    def originalThumbnail(self, filename):
+        return self._originalThumbnails.thumbnail(filename)
+
+    def thumbnail(self, filename):
+        res = self._thumbnails.thumbnail(filename)
+        if res is None and not self.prefetch and filename not in self._requestedThumbnails and self.hasImage(filename):
+            # Only textures that are shown get decoded
+            self._requestedThumbnails.add(filename)
+            self._pendingThumbnails.append(("skin", filename))
+            self._startThumbnails()
+        return res
+
+    def _scheduleThumbnails(self, kind, fns = None):
+        # Originals keep the thumbnails already in the atlas, fns are the ones missing
+        self._pendingThumbnails = [key for key in self._pendingThumbnails if key[0] != kind]
+        if kind == "orig":
+            self._pendingThumbnails.extend([("orig", fn) for fn in fns])
+        else:
+            self._thumbnails.clear()
+            self._requestedThumbnails = set()
+            if self.prefetch:
+                self._pendingThumbnails.extend([("skin", fn) for fn in self.imageFilenames()])
+        self._startThumbnails()
+
+    def _decodeThumbnail(self, kind, fn, image, path):
+        # Runs on the worker pool
+        if image is None:
+            if kind == "orig":
+                image = readAssetImage(self._assets, fn)
+            else:
+                image = QImage(path)
+        return (image, imageHash(image), image.scaled(ThumbnailAtlas.SIZE, ThumbnailAtlas.SIZE, Qt.KeepAspectRatio))
+
+    def hasPendingThumbnails(self):
+        return len(self._pendingThumbnails) > 0
+
+    @profiled("Document.buildThumbnails")
+    def buildThumbnails(self):
+        # One batch of the pending thumbnails, run from the timer when working in the background
+        if self._paused > 0:
+            return
+        batch = self._pendingThumbnails[:Document.THUMBNAIL_BATCH]
+        self._pendingThumbnails = self._pendingThumbnails[Document.THUMBNAIL_BATCH:]
+
+        jobs = []
+        for kind, fn in batch:
+            if kind == "orig":
+                if self.hasOriginalImage(fn) and fn not in self._originalMeta:
+                    jobs.append((kind, fn, None, None))
+            elif fn in self._images:
+                jobs.append((kind, fn, self._images[fn], None))
+            elif fn in self._files:
+                jobs.append((kind, fn, self._decoded.get(fn), self._files[fn][0]))
+
+        # Decode, hash and scale in parallel, the atlas and indexes are only touched from here
+        ready = []
+        for (kind, fn, image, path), (img, h, thumb) in zip(jobs, self._pool.map(lambda j: self._decodeThumbnail(*j), jobs)):
+            if kind == "orig":
+                self._setOriginalMeta(fn, img, h, thumb)
+            else:
+                if image is None:
+                    if fn not in self._loadedHashes:
+                        self._recordLoadedHash(fn, h)
+                    if self.prefetch:
+                        self._decoded.put(fn, img)
+                self._thumbnails.setThumbnail(fn, thumb)
+            ready.append(fn)
+        if len(self._dirtyMounts) > 0 and not any(kind == "orig" for kind, fn in self._pendingThumbnails):
+            self._saveJarCache()
+        if len(self._pendingThumbnails) == 0:
+            self._thumbnailTimer.stop()
+        if len(ready) > 0:
+            self.thumbnailsReady.emit(ready)
@@ -0,0 +1,123 @@
+#
+#    Sgt.Skinner - A Minecraft skin editor
+#    Copyright (C) 2020 Johan Thelin
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Opt-in timers and counters, enabled with SGTSKINNER_PROFILE=1 or from Tools - Performance
+
+import os
+import json
+import time
+import threading
+import functools
+import collections
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class _Timer:
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._profiler._record(self._name, self._start, time.perf_counter())
+        return False
+
+class Profiler:
+    # Trace events kept for dumping, the oldest are dropped first
+    MAX_EVENTS = 200000
+
+    def __init__(self):
+        self.enabled = os.environ.get("SGTSKINNER_PROFILE", "") == "1"
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._nullTimer = _NullTimer()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # name -> [calls, total seconds, max seconds]
+            self._timers = {}
+            self._counters = collections.Counter()
+            self._events = collections.deque(maxlen=Profiler.MAX_EVENTS)
+
+    def setEnabled(self, value):
+        self.enabled = value
+
+    def timed(self, name):
+        if self.enabled:
+            return _Timer(self, name)
+        else:
+            return self._nullTimer
+
+    def count(self, name, n = 1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += n
+
+    def _record(self, name, start, end):
+        with self._lock:
+            t = self._timers.setdefault(name, [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += end - start
+            t[2] = max(t[2], end - start)
+            self._events.append((name, start, end, threading.get_ident()))
+
+    def stats(self):
+        # Rows of (name, calls, total ms, mean ms, max ms), counters have no times
+        with self._lock:
+            res = []
+            for name in sorted(self._timers):
+                calls, total, worst = self._timers[name]
+                res.append((name, calls, total * 1000.0, total * 1000.0 / calls, worst * 1000.0))
+            for name in sorted(self._counters):
+                res.append((name, self._counters[name], None, None, None))
+            return res
+
+    def dumpTrace(self, path):
+        # Chrome trace event format, readable by chrome://tracing and Perfetto
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        trace = []
+        for name, start, end, tid in events:
+            trace.append({ "name": name, "ph": "X", "pid": pid, "tid": tid
+                         , "ts": (start - self._origin) * 1000000.0
+                         , "dur": (end - start) * 1000000.0 })
+        with open(path, 'w') as f:
+            json.dump({ "traceEvents": trace, "displayTimeUnit": "ms" }, f)
+
+profiler = Profiler()
+
+def profiled(name):
+    # Times every call of the decorated function while the profiler is enabled
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,128 @@
+#
+#    Sgt.Skinner - A Minecraft skin editor
+#    Copyright (C) 2020 Johan Thelin
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Per-file undo and redo stacks sharing one byte budget, deltas only need isEmpty() and sizeInBytes()
+
+import heapq
+
+class UndoHistory:
+    def __init__(self, budget = 64*1024*1024):
+        self._budget = budget
+        self.clear()
+
+    def clear(self):
+        self._used = 0
+        self._count = 0
+        self._sequence = 0
+        # filename -> [(sequence, delta)], undo stacks have the oldest first, redo stacks the next to redo last
+        self._undo = {}
+        self._redo = {}
+        # Eviction candidates as (sequence, filename, isRedo), the bottom of each undo stack and each
+        # redo stack as a whole, keyed on its oldest delta. Stale entries are skipped and compacted away
+        self._candidates = []
+
+    def setBudget(self, budget):
+        self._budget = budget
+        self._evict()
+
+    def usedBytes(self):
+        return self._used
+
+    def push(self, filename, delta):
+        if delta.isEmpty():
+            return
+        self._dropStack(self._redo, filename)
+        self._sequence += 1
+        self._undo.setdefault(filename, []).append((self._sequence, delta))
+        self._used += delta.sizeInBytes()
+        self._count += 1
+        self._track(filename)
+        self._evict()
+
+    def canUndo(self, filename):
+        return len(self._undo.get(filename, [])) > 0
+
+    def canRedo(self, filename):
+        return len(self._redo.get(filename, [])) > 0
+
+    def undo(self, filename):
+        if not self.canUndo(filename):
+            return None
+        entry = self._undo[filename].pop()
+        self._redo.setdefault(filename, []).append(entry)
+        self._track(filename)
+        return entry[1]
+
+    def redo(self, filename):
+        if not self.canRedo(filename):
+            return None
+        entry = self._redo[filename].pop()
+        self._undo.setdefault(filename, []).append(entry)
+        self._track(filename)
+        return entry[1]
+
+    def clearFile(self, filename):
+        self._dropStack(self._undo, filename)
+        self._dropStack(self._redo, filename)
+        self._compact()
+
+    def _dropStack(self, stacks, filename):
+        for sequence, delta in stacks.pop(filename, []):
+            self._used -= delta.sizeInBytes()
+            self._count -= 1
+
+    def _track(self, filename):
+        # Both ends that can be evicted may have changed, stale entries for them are skipped later
+        undo = self._undo.get(filename)
+        if undo:
+            heapq.heappush(self._candidates, (undo[0][0], filename, False))
+        redo = self._redo.get(filename)
+        if redo:
+            heapq.heappush(self._candidates, (redo[-1][0], filename, True))
+        self._compact()
+
+    def _isCandidate(self, sequence, filename, isRedo):
+        if isRedo:
+            redo = self._redo.get(filename)
+            return bool(redo) and redo[-1][0] == sequence
+        undo = self._undo.get(filename)
+        return bool(undo) and undo[0][0] == sequence
+
+    def _compact(self):
+        # At most two live entries per file, so rebuild once the stale ones dominate
+        if len(self._candidates) <= 2 * (len(self._undo) + len(self._redo)) + 64:
+            return
+        self._candidates = [(stack[0][0], fn, False) for fn, stack in self._undo.items() if stack] \
+                         + [(stack[-1][0], fn, True) for fn, stack in self._redo.items() if stack]
+        heapq.heapify(self._candidates)
+
+    def _evict(self):
+        # Drop the oldest steps, the most recent one is always kept. Undo stacks lose their oldest step,
+        # redo stacks are dropped whole, as their oldest step is the next one to redo
+        while self._used > self._budget and self._count > 1 and len(self._candidates) > 0:
+            sequence, filename, isRedo = heapq.heappop(self._candidates)
+            if not self._isCandidate(sequence, filename, isRedo):
+                continue
+            if isRedo:
+                self._dropStack(self._redo, filename)
+            else:
+                delta = self._undo[filename].pop(0)[1]
+                self._used -= delta.sizeInBytes()
+                self._count -= 1
+                if len(self._undo[filename]) == 0:
+                    del self._undo[filename]
+                self._track(filename)
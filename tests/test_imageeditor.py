@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+pytest.importorskip("PySide2")
+
+from PySide2.QtWidgets import QApplication
+from PySide2.QtGui import QImage, QColor
+from PySide2.QtCore import QPoint
+
+from sgtskinner import ImageEditor
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+def texelImage(width, height):
+    # Every texel a colour of its own, so a rendered pixel tells which texel it shows
+    img = QImage(width, height, QImage.Format_ARGB32)
+    for y in range(height):
+        for x in range(width):
+            img.setPixelColor(x, y, QColor(x, y, (x * 7 + y * 13) % 256))
+    return img
+
+@pytest.mark.parametrize("texels, widget, zoom", [
+    (16, 300, None),
+    (64, 300, None),
+    (16, 300, 5.3),
+    (64, 1000, 1.7),
+    (16, 300, 8.0),
+])
+def test_rendered_texels_match_the_mapping(app, texels, widget, zoom):
+    editor = ImageEditor()
+    editor.resize(widget, widget)
+    original = texelImage(texels, texels)
+    editor.setOriginalImage(original)
+    editor.setZoom(zoom)
+    rendered = QImage(editor.size(), QImage.Format_ARGB32)
+    editor.render(rendered)
+
+    shown = editor._imageRect.intersected(editor._viewRect())
+    wrong = 0
+    for y in range(shown.top(), shown.bottom() + 1):
+        for x in range(shown.left(), shown.right() + 1):
+            texel = editor._widgetToImagePos(QPoint(x, y), original)
+            if rendered.pixel(x, y) != original.pixel(texel):
+                wrong += 1
+    assert wrong == 0
@@ -0,0 +1,114 @@
+from skinundo import UndoHistory
+
+class Delta:
+    def __init__(self, name, size = 100):
+        self.name = name
+        self.size = size
+
+    def isEmpty(self):
+        return self.size == 0
+
+    def sizeInBytes(self):
+        return self.size
+
+def test_undo_redo_order():
+    h = UndoHistory()
+    a, b = Delta("a"), Delta("b")
+    h.push("f", a)
+    h.push("f", b)
+    assert h.undo("f") is b
+    assert h.undo("f") is a
+    assert h.undo("f") is None
+    assert h.redo("f") is a
+    assert h.redo("f") is b
+    assert h.redo("f") is None
+
+def test_empty_delta_is_ignored():
+    h = UndoHistory()
+    h.push("f", Delta("empty", 0))
+    assert not h.canUndo("f")
+
+def test_push_drops_redo():
+    h = UndoHistory()
+    h.push("f", Delta("a"))
+    h.undo("f")
+    h.push("f", Delta("b"))
+    assert not h.canRedo("f")
+    assert h.usedBytes() == 100
+
+def test_files_are_independent():
+    h = UndoHistory()
+    h.push("f", Delta("a"))
+    h.push("g", Delta("b"))
+    assert h.undo("f").name == "a"
+    assert h.canUndo("g")
+    assert not h.canRedo("g")
+
+def test_budget_evicts_oldest_undo_step():
+    h = UndoHistory(budget = 250)
+    for name in "abc":
+        h.push("f", Delta(name))
+    assert h.usedBytes() == 200
+    assert h.undo("f").name == "c"
+    assert h.undo("f").name == "b"
+    assert h.undo("f") is None
+
+def test_most_recent_step_is_kept_over_budget():
+    h = UndoHistory(budget = 10)
+    h.push("f", Delta("a"))
+    h.push("f", Delta("b"))
+    assert h.usedBytes() == 100
+    assert h.undo("f").name == "b"
+
+def test_eviction_never_splits_a_redo_stack():
+    h = UndoHistory(budget = 350)
+    for name in ["b1", "b2", "b3"]:
+        h.push("B", Delta(name))
+    for i in range(3):
+        h.undo("B")
+    h.push("A", Delta("a1"))
+    # Either B can still redo from b1, or its redo stack is gone as a whole
+    redo = h.redo("B")
+    assert redo is None or redo.name == "b1"
+    h.push("A", Delta("a2"))
+    assert h.usedBytes() <= 350
+
+def test_redo_stack_is_dropped_whole_when_it_is_oldest():
+    h = UndoHistory(budget = 250)
+    for name in ["b1", "b2"]:
+        h.push("B", Delta(name))
+    h.undo("B")
+    h.undo("B")
+    h.push("A", Delta("a1"))
+    h.push("A", Delta("a2"))
+    assert not h.canRedo("B")
+    assert h.usedBytes() == 200
+
+def test_discarded_steps_are_not_referenced():
+    h = UndoHistory(budget = 1000)
+    for i in range(10000):
+        h.push("f", Delta(i, 10))
+        h.undo("f")
+    assert h.usedBytes() == 10
+    assert len(h._candidates) < 100
+
+def test_clear_file():
+    h = UndoHistory()
+    h.push("f", Delta("a"))
+    h.push("f", Delta("b"))
+    h.undo("f")
+    h.push("g", Delta("c"))
+    h.clearFile("f")
+    assert not h.canUndo("f")
+    assert not h.canRedo("f")
+    assert h.usedBytes() == 100
+    assert h.undo("g").name == "c"
+
+def test_set_budget_evicts():
+    h = UndoHistory()
+    for name in "abcd":
+        h.push("f", Delta(name))
+    h.setBudget(150)
+    assert h.usedBytes() == 100
+    assert h.undo("f").name == "d"
+    assert not h.canUndo("f")